@@ -0,0 +1,89 @@
+"""Tests for the anchor_index module."""
+import os
+
+from anchor_index import (
+    AnchorIndex,
+    IndexedFile,
+    index_anchors,
+    merge_anchors,
+    strip_anchor_comments,
+)
+
+
+def test_anchor_comment_grammar():
+    lines = [
+        "# ANCHOR: plain",
+        "\t#ANCHOR:no_spaces  ",
+        "#   END:   no_spaces",
+        "var a # ANCHOR: not_alone",
+        "# anchor: lowercase",
+        "# ANCHOR: two words",
+        "# END: plain",
+    ]
+    anchors, errors = index_anchors(lines)
+    assert [
+        (anchor.name, anchor.start_line, anchor.end_line) for anchor in anchors
+    ] == [("no_spaces", 2, 2), ("plain", 1, 6)]
+    assert errors == []
+
+
+def test_nested_and_overlapping_anchors():
+    content = "\n".join(
+        [
+            "# ANCHOR: outer",
+            "a",
+            "# ANCHOR: inner",
+            "b",
+            "# END: outer",
+            "c",
+            "# END: inner",
+        ]
+    )
+    indexed_file = IndexedFile.from_content(content)
+    assert indexed_file.anchors == {"outer": (1, 4), "inner": (3, 6)}
+    assert indexed_file.get_anchor_content("outer") == "a\nb"
+    assert indexed_file.get_anchor_content("inner") == "b\nc"
+
+
+def test_malformed_anchors():
+    lines = ["# ANCHOR: a", "# ANCHOR: a", "# END: b", "# ANCHOR: c", "# END: a"]
+    anchors, errors = index_anchors(lines)
+    assert [anchor.name for anchor in anchors] == ["a"]
+    assert errors == [
+        'Line 2: anchor "a" opened again before its END (first opened on line 1).',
+        'Line 3: END of anchor "b" without a matching ANCHOR.',
+        'Line 4: anchor "c" is missing its END.',
+    ]
+
+
+def test_repeated_anchor_names_are_merged():
+    lines = ["# ANCHOR: a", "x", "# END: a", "y", "# ANCHOR: a", "z", "# END: a"]
+    anchors, _ = index_anchors(lines)
+    assert merge_anchors(anchors) == {"a": (1, 6)}
+    indexed_file = IndexedFile.from_content("\n".join(lines))
+    assert indexed_file.get_anchor_content("a") == "x\ny\nz"
+
+
+def test_strip_anchor_comments_keeps_line_endings():
+    content = "# ANCHOR: a\r\nfunc f():\r\n\tpass\r\n  # END: a\r\n# ANCHOR: b"
+    assert strip_anchor_comments(content) == "func f():\r\n\tpass\r\n"
+
+
+def test_index_persists_between_runs(tmp_path):
+    script_path = tmp_path / "script.gd"
+    script_path.write_text("# ANCHOR: a\nvar a\n# END: a\n")
+    index_path = tmp_path / "index.json"
+
+    index = AnchorIndex(index_path)
+    assert index.get_file(script_path).anchors == {"a": (1, 2)}
+    index.save()
+    assert index_path.exists()
+
+    # Touching the file keeps its entry, as its content didn't change.
+    os.utime(script_path, ns=(0, 0))
+    reloaded_file = AnchorIndex(index_path).get_file(script_path)
+    assert reloaded_file.anchors == {"a": (1, 2)}
+    assert reloaded_file.get_anchor_content("a") == "var a"
+
+    script_path.write_text("# ANCHOR: b\nvar b\n# END: b\n")
+    assert AnchorIndex(index_path).get_file(script_path).anchors == {"b": (1, 2)}
@@ -0,0 +1,37 @@
+"""Tests for the build_cache module."""
+import os
+
+from build_cache import DiskCache, get_umask, write_file_atomically
+
+
+def test_overwriting_an_entry_replaces_its_size(tmp_path):
+    cache = DiskCache(tmp_path, max_size=1000)
+    cache.set(("key",), b"a" * 100)
+    cache.set(("other",), b"b" * 100)
+    for _ in range(10):
+        cache.set(("key",), b"c" * 100)
+    assert cache._size == 200
+    assert cache.stats.evictions == 0
+    assert cache.get(("key",)) == b"c" * 100
+
+
+def test_eviction_removes_least_recently_used_entries(tmp_path):
+    cache = DiskCache(tmp_path, max_size=250)
+    cache.set(("old",), b"a" * 100)
+    os.utime(cache.get_entry_path(("old",)), (0, 0))
+    cache.set(("new",), b"b" * 100)
+    cache.set(("newest",), b"c" * 100)
+    assert cache.get(("old",)) is None
+    assert cache.get(("newest",)) == b"c" * 100
+
+
+def test_atomic_writes_use_the_umask(tmp_path):
+    umask: int = os.umask(0o022)
+    os.umask(umask)
+    assert get_umask() == umask
+
+    path = tmp_path / "directory" / "file.txt"
+    write_file_atomically(path, b"content")
+    assert path.read_bytes() == b"content"
+    assert os.stat(path).st_mode & 0o777 == 0o666 & ~umask
+    assert os.listdir(path.parent) == ["file.txt"]
@@ -0,0 +1,6 @@
+"""Lets tests import the build system's modules, which import each other by
+name from the scons directory."""
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent / "scons"))
@@ -0,0 +1,69 @@
+"""Tests for the document module."""
+from document import BlockTypes, Document
+
+
+def get_block_types(document: Document) -> list:
+    return [(block.type, block.text) for block in document.blocks]
+
+
+def test_fences_with_info_strings():
+    content = "Intro\n```GDScript\nvar a\n```\nText after ```gdscript\nx\n```"
+    document = Document.parse(content)
+    assert get_block_types(document) == [
+        (BlockTypes.text, "Intro\n"),
+        (BlockTypes.code, "var a\n"),
+        (BlockTypes.text, "Text after ```gdscript\nx\n"),
+        (BlockTypes.code, ""),
+    ]
+    assert document.blocks[1].language == "GDScript"
+    assert document.serialize() == content
+
+
+def test_tilde_fences_and_attributes():
+    content = "~~~\n```\ninside\n~~~\n````{.gdscript .numberLines}\ny\n````\n"
+    document = Document.parse(content)
+    assert get_block_types(document) == [
+        (BlockTypes.code, "```\ninside\n"),
+        (BlockTypes.code, "y\n"),
+    ]
+    assert [block.language for block in document.blocks] == ["", "gdscript"]
+    assert document.serialize() == content
+
+
+def test_closing_fence_must_match_the_opening_fence():
+    content = "````\n```\nstill code\n````\nText\n"
+    document = Document.parse(content)
+    assert get_block_types(document) == [
+        (BlockTypes.code, "```\nstill code\n"),
+        (BlockTypes.text, "Text\n"),
+    ]
+
+
+def test_unclosed_fence_runs_to_the_end_of_the_document():
+    content = "Text\n```gdscript\nvar a\n# Not a heading"
+    document = Document.parse(content)
+    assert get_block_types(document) == [
+        (BlockTypes.text, "Text\n"),
+        (BlockTypes.code, "var a\n# Not a heading"),
+    ]
+    assert document.serialize() == content
+
+
+def test_headings_and_templates_outside_code():
+    content = "# Title\r\n\r\n{% contents %}\n```\n# comment\n{% include a.gd %}\n```"
+    document = Document.parse(content)
+    assert get_block_types(document) == [
+        (BlockTypes.heading, "# Title\r"),
+        (BlockTypes.text, "\r\n"),
+        (BlockTypes.template, "{% contents %}"),
+        (BlockTypes.code, "# comment\n{% include a.gd %}\n"),
+    ]
+    assert document.serialize() == content
+
+
+def test_replacing_a_code_block_keeps_the_line_break_after_it():
+    document = Document.parse("```\ncode\n```\nText\n")
+    block = document.get_blocks(BlockTypes.code)[0]
+    block.type = BlockTypes.html
+    block.text = "<pre>code</pre>"
+    assert document.serialize() == "<pre>code</pre>\nText\n"
@@ -0,0 +1,44 @@
+"""Tests for the epub_chapter module."""
+from epub_chapter import shift_headings
+
+
+def test_atx_headings():
+    content = "# Title #\n\n## Section\n\n#NotAHeading\n\n   ### Indented\n"
+    assert shift_headings(content) == (
+        "## Title #\n\n### Section\n\n#NotAHeading\n\n   #### Indented\n"
+    )
+
+
+def test_atx_heading_needs_a_blank_line_before_it():
+    content = "Paragraph\n# Not a heading\n"
+    assert shift_headings(content) == content
+
+
+def test_setext_headings():
+    content = "Title\n=====\n\nSection on\ntwo lines\n---\n\nText\r\n--\r\n"
+    assert shift_headings(content) == (
+        "## Title\n\n### Section on two lines\n\n### Text\r\n"
+    )
+
+
+def test_setext_underline_after_a_list_or_a_blank_line():
+    content = "- item\n---\n\n---\n> quote\n===\n"
+    assert shift_headings(content) == content
+
+
+def test_headings_deeper_than_six_become_paragraphs():
+    content = "###### Deep ######\n\nParagraph\n---\n"
+    assert shift_headings(content, offset=5) == (
+        "\nDeep\n\n\n\nParagraph\n\n"
+    )
+
+
+def test_code_blocks_and_front_matter_stay_unchanged():
+    content = (
+        "---\ntitle: Lesson\n---\n# Title\n\n```gdscript\n# Comment\nvar a\n---\n```\n"
+        "Text\n===\n"
+    )
+    assert shift_headings(content) == (
+        "---\ntitle: Lesson\n---\n## Title\n\n```gdscript\n# Comment\nvar a\n---\n```\n"
+        "## Text\n"
+    )
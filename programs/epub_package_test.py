@@ -0,0 +1,71 @@
+"""Tests for the epub_package module."""
+import xml.etree.ElementTree as ElementTree
+import zipfile
+
+from epub_package import (
+    FALLBACK_DOCUMENT_ID,
+    FALLBACK_DOCUMENT_NAME,
+    BookMetadata,
+    Resource,
+    to_xhtml,
+    write_epub,
+)
+
+XHTML_NAMESPACE = "{http://www.w3.org/1999/xhtml}"
+OPF_NAMESPACE = "{http://www.idpf.org/2007/opf}"
+
+
+def test_raw_html_becomes_well_formed_xhtml():
+    html = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml"><head><meta charset="utf-8">'
+        "<style>p > a { color: red; }</style></head>\n"
+        "<body><p>Tom &amp; Jerry&nbsp;<br><img src=icon.png alt='a \"b\"'>"
+        "<video controls><source src=clip.mp4></video><!-- note -- here -->"
+        "<ul><li>Unclosed</ul></div></p></body></html>"
+    )
+    xhtml = to_xhtml(html)
+    root = ElementTree.fromstring(xhtml.encode("utf-8"))
+    body = root.find(XHTML_NAMESPACE + "body")
+    paragraph = body.find(XHTML_NAMESPACE + "p")
+    assert paragraph.text == "Tom & Jerry\u00a0"
+    assert paragraph.find(XHTML_NAMESPACE + "img").get("alt") == 'a "b"'
+    assert paragraph.find(XHTML_NAMESPACE + "video").get("controls") == "controls"
+    assert "note" not in xhtml
+    assert xhtml.startswith('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>')
+
+
+def test_pandoc_output_stays_the_same():
+    xhtml = (
+        '<html xmlns="http://www.w3.org/1999/xhtml">\n<head>\n'
+        '  <meta charset="utf-8" />\n</head>\n<body>\n'
+        '<h1 id="title">Title</h1>\n<p>Text with <code>a &lt; b</code>.</p>\n'
+        "</body>\n</html>"
+    )
+    assert to_xhtml(xhtml) == xhtml
+
+
+def test_videos_get_a_fallback_document(tmp_path):
+    chapter_path = tmp_path / "chapter.xhtml"
+    chapter_path.write_text(
+        to_xhtml('<html xmlns="http://www.w3.org/1999/xhtml"><body><h1 id="a">A</h1></body></html>')
+    )
+    video_path = tmp_path / "clip.mp4"
+    video_path.write_bytes(b"video")
+    epub_path = tmp_path / "book.epub"
+    write_epub(
+        epub_path,
+        BookMetadata("Book"),
+        [chapter_path],
+        [Resource("images/clip.mp4", video_path)],
+    )
+
+    with zipfile.ZipFile(epub_path) as archive:
+        package = ElementTree.fromstring(archive.read("EPUB/package.opf"))
+        ElementTree.fromstring(archive.read("EPUB/" + FALLBACK_DOCUMENT_NAME))
+    items = {
+        item.get("href"): item
+        for item in package.iter(OPF_NAMESPACE + "item")
+    }
+    assert items["images/clip.mp4"].get("fallback") == FALLBACK_DOCUMENT_ID
+    assert items[FALLBACK_DOCUMENT_NAME].get("id") == FALLBACK_DOCUMENT_ID
@@ -0,0 +1,56 @@
+"""Tests for the git_tags module."""
+import subprocess
+from pathlib import Path
+
+from git_tags import describe_tags, find_exact_tag
+
+
+def git(directory: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-c", "user.name=Test", "-c", "user.email=test@example.com", *args],
+        cwd=directory,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+def create_repository(directory: Path) -> None:
+    git(directory, "init", "-q")
+    git(directory, "commit", "-q", "--allow-empty", "-m", "First commit")
+
+
+def test_loose_tags(tmp_path):
+    create_repository(tmp_path)
+    git(tmp_path, "tag", "-a", "-m", "Release", "1.0.0")
+    assert find_exact_tag(tmp_path) == "1.0.0"
+    git(tmp_path, "commit", "-q", "--allow-empty", "-m", "Second commit")
+    assert find_exact_tag(tmp_path) is None
+    assert describe_tags(tmp_path) == git(tmp_path, "describe", "--tags")
+
+
+def test_packed_annotated_and_lightweight_tags(tmp_path):
+    create_repository(tmp_path)
+    git(tmp_path, "tag", "lightweight")
+    git(tmp_path, "tag", "-a", "-m", "Release", "1.0.0")
+    git(tmp_path, "pack-refs", "--all")
+    # Several tags point to HEAD, so git picks one.
+    assert find_exact_tag(tmp_path) is None
+    assert describe_tags(tmp_path) == "1.0.0"
+
+
+def test_packed_tags_without_peeled_lines(tmp_path):
+    create_repository(tmp_path)
+    git(tmp_path, "tag", "-a", "-m", "Release", "1.0.0")
+    git(tmp_path, "pack-refs", "--all")
+    # Older versions of git don't write which commit annotated tags point to.
+    packed_refs_path = tmp_path / ".git" / "packed-refs"
+    lines = packed_refs_path.read_text().splitlines()
+    packed_refs_path.write_text(
+        "".join(line + "\n" for line in lines if not line.startswith(("#", "^")))
+    )
+    assert find_exact_tag(tmp_path) == "1.0.0"
+
+    git(tmp_path, "tag", "lightweight")
+    assert find_exact_tag(tmp_path) is None
+    assert describe_tags(tmp_path) == "1.0.0"
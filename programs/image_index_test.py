@@ -0,0 +1,52 @@
+"""Tests for the image_index module."""
+from image_index import ImageIndex, rename_path, rename_references
+
+
+def test_files_are_grouped_by_name_and_content(tmp_path):
+    for directory, name, content in [
+        ("a", "icon.png", b"icon"),
+        ("b", "icon.png", b"other"),
+        ("b", "copy.png", b"icon"),
+        ("c", "unique.png", b"unique content"),
+    ]:
+        (tmp_path / directory).mkdir(exist_ok=True)
+        (tmp_path / directory / name).write_bytes(content)
+    index = ImageIndex.from_files(sorted(tmp_path.glob("*/*.png")))
+
+    assert index.get_conflicting_names() == {
+        "icon.png": [tmp_path / "a" / "icon.png", tmp_path / "b" / "icon.png"]
+    }
+    assert index.get_unique_files() == [
+        tmp_path / "a" / "icon.png",
+        tmp_path / "b" / "icon.png",
+        tmp_path / "c" / "unique.png",
+    ]
+    assert index.get_renames() == {"copy.png": "icon.png"}
+    assert index.get_saved_size() == len(b"icon")
+
+
+def test_rename_path():
+    renames = {"copy.png": "icon.png"}
+    assert rename_path("images/copy.png?size=2#top", renames) == (
+        "images/icon.png?size=2#top"
+    )
+    assert rename_path("copy.png", renames) == "icon.png"
+    assert rename_path("other.png", renames) == "other.png"
+    assert rename_path("https://example.com/copy.png", renames) == (
+        "https://example.com/copy.png"
+    )
+
+
+def test_rename_references():
+    content = (
+        "![Alt](images/copy.png) ![Alt][label]\n\n"
+        '<video src="copy.png"></video>\n\n'
+        "[label]: <images/copy.png>\n"
+        "[link]: https://example.com/copy.png\n"
+    )
+    assert rename_references(content, {"copy.png": "icon.png"}) == (
+        "![Alt](images/icon.png) ![Alt][label]\n\n"
+        '<video src="icon.png"></video>\n\n'
+        "[label]: <images/icon.png>\n"
+        "[link]: https://example.com/copy.png\n"
+    )
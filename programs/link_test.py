@@ -0,0 +1,14 @@
+"""Tests for the link module."""
+from pathlib import Path
+
+from link import LinkIndex, process_document
+
+
+def test_links_get_replaced_in_prose_and_code_blocks():
+    link_index = LinkIndex.from_files("content", ["content/01.intro/Intro.md"])
+    content = "See {% link Intro %}.\n\n{% link Intro anchor %}\n```\n{% link Intro %}\n```\n"
+    assert process_document(content, Path("lesson.md"), link_index) == (
+        "See [Intro](../Intro/Intro.html).\n\n"
+        "[Intro](../Intro/Intro.html#anchor)\n"
+        "```\n[Intro](../Intro/Intro.html)\n```\n"
+    )
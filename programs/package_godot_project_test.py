@@ -0,0 +1,73 @@
+"""Tests for the package_godot_project module."""
+import os
+import zipfile
+
+import package_godot_project
+from package_godot_project import package_project
+
+
+def create_project(directory):
+    (directory / "project.godot").write_text("config_version=4\n")
+    (directory / "scenes").mkdir()
+    (directory / "scenes" / "main.gd").write_text("extends Node\n" * 1000)
+    (directory / "scenes" / "icon.png").write_bytes(bytes(range(256)) * 10)
+    (directory / ".import").mkdir()
+    (directory / ".import" / "icon.png.import").write_text("ignored")
+    (directory / "empty.txt").write_text("")
+
+
+def test_output_is_deterministic(tmp_path, monkeypatch):
+    # Small chunks split files into several independently compressed chunks.
+    monkeypatch.setattr(package_godot_project, "CHUNK_SIZE", 1000)
+    project = tmp_path / "project"
+    project.mkdir()
+    create_project(project)
+    first_path = tmp_path / "first.zip"
+    package_project(str(project), str(first_path), jobs=2)
+
+    os.utime(project / "scenes" / "main.gd", ns=(0, 0))
+    second_path = tmp_path / "second.zip"
+    package_project(str(project), str(second_path), jobs=1)
+    assert first_path.read_bytes() == second_path.read_bytes()
+
+    with zipfile.ZipFile(first_path) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [
+            "scenes/",
+            "empty.txt",
+            "project.godot",
+            "scenes/icon.png",
+            "scenes/main.gd",
+        ]
+        assert archive.getinfo("scenes/icon.png").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("scenes/main.gd").date_time == (1980, 1, 1, 0, 0, 0)
+        assert archive.read("scenes/main.gd") == (
+            (project / "scenes" / "main.gd").read_bytes()
+        )
+
+
+def test_unchanged_files_are_copied_from_the_previous_archive(tmp_path, monkeypatch):
+    project = tmp_path / "project"
+    project.mkdir()
+    create_project(project)
+    output_path = tmp_path / "project.zip"
+    manifest_path = tmp_path / "project.json"
+    package_project(str(project), str(output_path), 1, str(manifest_path))
+
+    compressed_sizes = []
+    compress_chunk = package_godot_project.compress_chunk
+
+    def count_chunks(data, method, is_last):
+        compressed_sizes.append(len(data))
+        return compress_chunk(data, method, is_last)
+
+    monkeypatch.setattr(package_godot_project, "compress_chunk", count_chunks)
+    # A new modification time with the same content still reuses the file.
+    os.utime(project / "scenes" / "main.gd", ns=(0, 0))
+    (project / "project.godot").write_text("config_version=5\n")
+    package_project(str(project), str(output_path), 1, str(manifest_path))
+    assert compressed_sizes == [len("config_version=5\n")]
+
+    fresh_path = tmp_path / "fresh.zip"
+    package_project(str(project), str(fresh_path), 1)
+    assert output_path.read_bytes() == fresh_path.read_bytes()
@@ -0,0 +1,58 @@
+"""Tests for the prepare_for_mavenseed module."""
+import io
+
+import pytest
+
+from prepare_for_mavenseed import H1IdIndex, replace_links, stream_html_body
+
+HTML = (
+    '<html><head><link href="style.css"></head><body>\n'
+    '<h1 id="intro">Intro</h1>\n'
+    '<a href="../lesson/other.html">Other</a> <a href="#intro">Top</a>\n'
+    '<img src="data:image/png;base64,aHJlZj0iLi4vb3RoZXIuaHRtbCI=">\n'
+    '<a href="https://example.com/other.html">External</a>\n'
+    '<a href="data:text/plain,href=%22other.html">Data link</a>\n'
+    '<a href="missing">Missing</a>\n'
+    "</body></html>"
+)
+
+
+@pytest.fixture
+def h1_id_index(tmp_path):
+    other_path = tmp_path / "other.html"
+    other_path.write_text('<body><h1 id="other-lesson">Other</h1></body>')
+    return H1IdIndex.from_files([other_path])
+
+
+def stream(html: str, h1_id_index: H1IdIndex, chunk_size: int) -> str:
+    output_file = io.StringIO()
+    written = stream_html_body(io.StringIO(html), output_file, h1_id_index, chunk_size)
+    output = output_file.getvalue()
+    assert written == len(output)
+    return output
+
+
+def test_stream_matches_replace_links(h1_id_index):
+    body = HTML[HTML.index("<body>") + len("<body>") : HTML.index("</body>")]
+    expected = replace_links(body, h1_id_index)
+    assert 'href="other-lesson"' in expected
+    assert "data:image/png;base64,aHJlZj0iLi4vb3RoZXIuaHRtbCI=" in expected
+    # Chunks of every size split the markers and links at every position.
+    for chunk_size in range(1, 40):
+        assert stream(HTML, h1_id_index, chunk_size) == expected, chunk_size
+
+
+def test_data_uris_are_copied_as_is(h1_id_index):
+    html = '<body><img src="data:a,href="><a href="other.html">x</a></body>'
+    for chunk_size in (1, 2, 3, 7, 64):
+        assert (
+            stream(html, h1_id_index, chunk_size)
+            == '<img src="data:a,href="><a href="other-lesson">x</a>'
+        )
+
+
+def test_missing_body_tags(h1_id_index):
+    with pytest.raises(ValueError):
+        stream("<html><head></head></html>", h1_id_index, 4)
+    with pytest.raises(ValueError):
+        stream("<html><body><p>Text</p></html>", h1_id_index, 4)
@@ -2,29 +2,71 @@
 """Markdown preprocessor that reads a markdown document looking for Godot's
 built-in class names and appends the corresponding icon image in front.
 
-It only adds icons to built-in node names outside code fences."""
+It only adds icons to built-in node names outside code fences.
+
+Icons can be output in two ways:
+
+- img: an <img> tag pointing to the icon file for each class name.
+- sprite: a single inline SVG sprite at the end of the document with one
+  <symbol> per icon, and an <svg><use> reference for each class name. Use this
+  mode with self-contained HTML output so each icon is embedded once."""
 import argparse
+import functools
 import itertools
 import logging
 import os
 import re
 import sys
 from dataclasses import dataclass
-from typing import List
+from enum import Enum
+from typing import Dict, List
 
+from document import Block, BlockTypes, Document
 from gdscript_class_list import BUILT_IN_CLASSES
 from scons_helper import print_error
 
 LOGGER = logging.getLogger("format_tutorial.py")
 ERROR_INCORRECT_FILE_PATHS: int = 2
 
-RE_SPLIT_CODE_BLOCK: re.Pattern = re.compile("(```[a-z]*\n.*?```)", flags=re.DOTALL)
-RE_BUILT_IN_CLASSES: re.Pattern = re.compile(
-    "(`{}`)".format("`|`".join(BUILT_IN_CLASSES))
-)
+# Matches inline code containing a single identifier, like `Node2D`.
+RE_INLINE_IDENTIFIER: re.Pattern = re.compile(r"`(\w+)`")
 RE_PASCAL_TO_SNAKE_CASE: re.Pattern = re.compile(
     "((?<=[a-z])[A-Z0-9]|(?!^)[A-Z](?=[a-z]))"
 )
+RE_SVG: re.Pattern = re.compile(r"<svg(?P<attributes>[^>]*)>(?P<body>.*)</svg>", re.DOTALL)
+RE_SVG_VIEW_BOX: re.Pattern = re.compile(r'viewBox="([^"]+)"')
+RE_SVG_SIZE: re.Pattern = re.compile(r'\b(width|height)="([\d.]+)"')
+# Matches the ids an SVG defines and the references to them, to make them unique
+# in a sprite.
+RE_SVG_ID: re.Pattern = re.compile(r"(?<![\w:-])id=([\"'])")
+RE_SVG_ID_REFERENCE: re.Pattern = re.compile(r"(\burl\(\s*[\"']?#|\bhref=[\"']#)")
+ICONS_DIRECTORY: str = os.path.join(os.path.dirname(__file__), "godot-icons")
+
+
+def get_icon_filename(class_name: str) -> str:
+    """Returns the name of the icon file for a class, like icon_node_2d.svg for
+    Node2D."""
+    return "icon_" + RE_PASCAL_TO_SNAKE_CASE.sub(r"_\1", class_name).lower() + ".svg"
+
+
+def build_icon_manifest(icons_directory: str) -> Dict[str, str]:
+    """Maps built-in class names to the path of their icon, for classes that
+    have an icon in `icons_directory`."""
+    icon_filenames: set = set(os.listdir(icons_directory))
+    return {
+        class_name: os.path.join(icons_directory, get_icon_filename(class_name))
+        for class_name in BUILT_IN_CLASSES
+        if get_icon_filename(class_name) in icon_filenames
+    }
+
+
+BUILT_IN_CLASS_NAMES: frozenset = frozenset(BUILT_IN_CLASSES)
+ICON_PATHS: Dict[str, str] = build_icon_manifest(ICONS_DIRECTORY)
+
+
+class IconModes(Enum):
+    img = "img"
+    sprite = "sprite"
 
 
 @dataclass
@@ -51,6 +93,14 @@ def parse_command_line_arguments(args) -> argparse.Namespace:
     parser.add_argument(
         "-i", "--in-place", action="store_true", help="Overwrite the source files."
     )
+    parser.add_argument(
+        "-m",
+        "--icon-mode",
+        type=IconModes,
+        default=IconModes.img,
+        choices=list(IconModes),
+        help="Output one <img> tag per icon, or an inline SVG sprite with references.",
+    )
     return parser.parse_args(args)
 
 
@@ -75,48 +125,102 @@ def output_result(args: argparse.Namespace, document: ProcessedDocument) -> None
             output_file.write(document.content)
 
 
-def process_file(file_path) -> ProcessedDocument:
+def process_file(file_path, icon_mode: IconModes = IconModes.img) -> ProcessedDocument:
     output: ProcessedDocument
     with open(file_path, "r") as markdown_file:
-        content: str = add_built_in_icons(markdown_file.read())
+        content: str = add_built_in_icons(markdown_file.read(), icon_mode)
         output = ProcessedDocument(file_path, content)
     return output
 
 
-def add_built_in_icons(content: str) -> str:
-    """Inserts icons in front of built-in classes outside markdown code fences."""
+def get_symbol_id(class_name: str) -> str:
+    return get_icon_filename(class_name)[: -len(".svg")]
+
+
+@functools.lru_cache(maxsize=None)
+def get_icon_symbol(class_name: str) -> str:
+    """Returns the icon of `class_name` as an SVG <symbol> tag on a single line."""
+    with open(ICON_PATHS[class_name], "r") as svg_file:
+        match = RE_SVG.search(svg_file.read())
+    attributes: str = match.group("attributes")
+    view_box_match = RE_SVG_VIEW_BOX.search(attributes)
+    if view_box_match:
+        view_box: str = view_box_match.group(1)
+    else:
+        size: dict = dict(RE_SVG_SIZE.findall(attributes))
+        view_box = "0 0 {} {}".format(size.get("width", 16), size.get("height", 16))
+    body: str = " ".join(line.strip() for line in match.group("body").splitlines())
+    # Icons reuse ids like gradients, so we prefix them with the symbol's id.
+    symbol_id: str = get_symbol_id(class_name)
+    body = RE_SVG_ID.sub(r"\g<0>" + symbol_id + "-", body)
+    body = RE_SVG_ID_REFERENCE.sub(r"\g<0>" + symbol_id + "-", body)
+    return '<symbol id="{}" viewBox="{}">{}</symbol>'.format(
+        symbol_id, view_box, body
+    )
+
+
+def create_svg_sprite(class_names: List[str]) -> str:
+    """Returns a hidden inline SVG element defining one symbol per class name.
+
+    We hide the sprite by giving it no size, as some browsers don't render
+    gradients and masks defined inside an element with `display: none`."""
+    symbols: str = "".join(get_icon_symbol(class_name) for class_name in class_names)
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="0" height="0" '
+        'style="position: absolute;">{}</svg>'
+    ).format(symbols)
+
+
+def process_parsed_document(
+    document: Document, icon_mode: IconModes = IconModes.img
+) -> None:
+    """Inserts icons in front of built-in classes outside markdown code fences.
+
+    In sprite mode, appends the SVG sprite with the icons used in the document
+    at the end of the document."""
+    used_class_names: Dict[str, None] = {}
 
     def prepend_icon(match: re.Match) -> str:
         """Returns the matched node name pattern as a string, with an image tag for the
         corresponding icon.
         """
         TEMPLATE = '<img src="{}" class="node-icon"/>'
-        class_name: str = match.group(0).replace("`", "")
-
-        icon_filename: str = "icon_" + RE_PASCAL_TO_SNAKE_CASE.sub(
-            r"_\1", class_name
-        ).lower()
+        SPRITE_TEMPLATE = '<svg class="node-icon"><use href="#{}"/></svg>'
+        class_name: str = match.group(1)
+        if class_name not in BUILT_IN_CLASS_NAMES:
+            return match.group(0)
 
-        icon_filepath: str = os.path.join(
-            os.path.dirname(__file__), "godot-icons", icon_filename + ".svg"
-        )
-        if not os.path.exists(icon_filepath):
-            LOGGER.warning("File {} not found.".format(icon_filepath))
+        icon_filepath: str = ICON_PATHS.get(class_name, "")
+        if not icon_filepath:
+            LOGGER.warning(
+                "File {} not found.".format(
+                    os.path.join(ICONS_DIRECTORY, get_icon_filename(class_name))
+                )
+            )
             return match.group(0)
 
+        if icon_mode == IconModes.sprite:
+            used_class_names[class_name] = None
+            return SPRITE_TEMPLATE.format(get_symbol_id(class_name)) + match.group(0)
         return TEMPLATE.format(icon_filepath) + match.group(0)
 
-    output: str = ""
-    sections: List[str] = re.split(RE_SPLIT_CODE_BLOCK, content)
-    formatted_sections: List[str] = []
+    for block in document.get_blocks(BlockTypes.text, BlockTypes.heading):
+        block.text = RE_INLINE_IDENTIFIER.sub(prepend_icon, block.text)
+
+    if used_class_names:
+        document.blocks.append(
+            Block(
+                BlockTypes.html,
+                "\n\n" + create_svg_sprite(list(used_class_names)) + "\n",
+            )
+        )
 
-    for section in sections:
-        # Only add image tags outside code fences.
-        if not section.startswith("```"):
-            section = re.sub(RE_BUILT_IN_CLASSES, prepend_icon, section)
-        formatted_sections.append(section)
 
-    return "\n".join(formatted_sections)
+def add_built_in_icons(content: str, icon_mode: IconModes = IconModes.img) -> str:
+    """Inserts icons in front of built-in classes outside markdown code fences."""
+    document = Document.parse(content)
+    process_parsed_document(document, icon_mode)
+    return document.serialize()
 
 
 def main():
@@ -137,7 +241,9 @@ def main():
         )
         sys.exit(ERROR_INCORRECT_FILE_PATHS)
 
-    documents: List[ProcessedDocument] = list(map(process_file, filepaths))
+    documents: List[ProcessedDocument] = [
+        process_file(file_path, args.icon_mode) for file_path in filepaths
+    ]
     list(map(output_result, itertools.repeat(args), documents))
 
 
@@ -0,0 +1,245 @@
+"""Finds anchors in GDScript and shader files and keeps an index of them on disk.
+
+Anchors are comments that delimit part of a file to include in a document:
+
+```gdscript
+# ANCHOR: name
+func example():
+	pass
+# END: name
+```
+
+The index maps file paths to the position of their anchors, and each project
+gets its own index file. On the next run, files with the same modification
+time and size, or the same content, don't get parsed again. Both the build
+system and the tutorial linter use it.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from build_cache import get_default_cache_directory, hash_text, open_file_atomically
+from document import RE_LINE
+
+INDEX_VERSION: int = 2
+
+# Matches a line containing only an anchor comment like `# ANCHOR: name` or
+# `# END: name`, with any number of spaces after `#` and `:`.
+RE_ANCHOR_COMMENT: re.Pattern = re.compile(
+    r"^\s*# *(?P<kind>ANCHOR|END): *(?P<name>\w+)\s*$"
+)
+
+
+@dataclass
+class Anchor:
+    """Range of lines between an ANCHOR and an END comment, excluding them."""
+
+    name: str
+    start_line: int
+    end_line: int
+
+
+def index_anchors(lines: List[str]) -> Tuple[List[Anchor], List[str]]:
+    """Scans `lines` once and returns the list of anchors and the list of error
+    messages for malformed anchors.
+
+    Supports nested and overlapping anchors. Line numbers are 0-based."""
+    anchors: List[Anchor] = []
+    errors: List[str] = []
+    open_anchors: dict = {}
+
+    for line_number, line in enumerate(lines):
+        match = RE_ANCHOR_COMMENT.match(line)
+        if not match:
+            continue
+        kind, name = match.group("kind"), match.group("name")
+        if kind == "ANCHOR":
+            if name in open_anchors:
+                errors.append(
+                    f'Line {line_number + 1}: anchor "{name}" opened again before its END '
+                    f"(first opened on line {open_anchors[name] + 1})."
+                )
+                continue
+            open_anchors[name] = line_number
+        else:
+            if name not in open_anchors:
+                errors.append(
+                    f'Line {line_number + 1}: END of anchor "{name}" without a matching ANCHOR.'
+                )
+                continue
+            anchors.append(Anchor(name, open_anchors.pop(name) + 1, line_number))
+
+    for name, line_number in open_anchors.items():
+        errors.append(f'Line {line_number + 1}: anchor "{name}" is missing its END.')
+    return anchors, errors
+
+
+def merge_anchors(anchors: List[Anchor]) -> Dict[str, Tuple[int, int]]:
+    """Maps anchor names to their range of lines.
+
+    If a file uses an anchor name several times, the anchor goes from its first
+    ANCHOR to its last END, and the comments in between get removed."""
+    ranges: Dict[str, Tuple[int, int]] = {}
+    for anchor in anchors:
+        start_line, end_line = ranges.get(
+            anchor.name, (anchor.start_line, anchor.end_line)
+        )
+        ranges[anchor.name] = (
+            min(start_line, anchor.start_line),
+            max(end_line, anchor.end_line),
+        )
+    return ranges
+
+
+def get_anchor_content(lines: List[str], anchor: Anchor) -> str:
+    """Returns the lines of `anchor`, without the comments of other anchors
+    nested inside it."""
+    return "\n".join(
+        line
+        for line in lines[anchor.start_line : anchor.end_line]
+        if not RE_ANCHOR_COMMENT.match(line)
+    )
+
+
+def strip_anchor_comments(content: str) -> str:
+    """Returns `content` without the lines that are anchor comments, keeping
+    line endings as they are."""
+    return "".join(
+        line
+        for line in RE_LINE.findall(content)
+        if not RE_ANCHOR_COMMENT.match(line.rstrip("\r\n"))
+    )
+
+
+def get_index_path(
+    project_directory: Path, cache_directory: Optional[Path] = None
+) -> Path:
+    """Returns the path of the index file for the project in
+    `project_directory`, in `cache_directory` or the default cache directory."""
+    if cache_directory is None:
+        cache_directory = get_default_cache_directory()
+    index_name: str = hash_text(os.path.abspath(project_directory)) + ".json"
+    return Path(cache_directory) / "anchor_indexes" / index_name
+
+
+@dataclass
+class IndexedFile:
+    """Anchors of one file. The file's content only gets read when needed."""
+
+    path: str
+    anchors: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+    errors: List[str] = field(default_factory=list)
+    _content: Optional[str] = field(default=None, repr=False)
+
+    @classmethod
+    def from_content(cls, content: str, path: str = "") -> "IndexedFile":
+        anchors, errors = index_anchors(content.split("\n"))
+        return cls(path, merge_anchors(anchors), errors, content)
+
+    @property
+    def content(self) -> str:
+        if self._content is None:
+            with open(self.path, "r") as text_file:
+                self._content = text_file.read()
+        return self._content
+
+    def get_anchor_content(self, name: str) -> str:
+        start_line, end_line = self.anchors[name]
+        return get_anchor_content(
+            self.content.split("\n"), Anchor(name, start_line, end_line)
+        )
+
+
+class AnchorIndex:
+    """Index of file anchors, persisted between runs.
+
+    Entries are keyed by absolute file path and validated with the file's
+    modification time and size. If those changed, the file's content hash
+    decides whether the entry is still valid, so touching or checking out a
+    file doesn't invalidate it."""
+
+    def __init__(self, index_path: Optional[Path] = None) -> None:
+        self.index_path: Optional[Path] = index_path
+        self._entries: Dict[str, dict] = {}
+        self._files: Dict[str, IndexedFile] = {}
+        self._is_modified: bool = False
+        self._lock = threading.Lock()
+        if index_path is not None:
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.index_path, "r") as index_file:
+                data: dict = json.load(index_file)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == INDEX_VERSION:
+            self._entries = data["files"]
+
+    def save(self) -> None:
+        """Writes the index to disk if it changed, dropping deleted files."""
+        if self.index_path is None or not self._is_modified:
+            return
+        with self._lock:
+            files: dict = {
+                path: entry
+                for path, entry in self._entries.items()
+                if os.path.exists(path)
+            }
+            with open_file_atomically(self.index_path, "w") as index_file:
+                json.dump({"version": INDEX_VERSION, "files": files}, index_file)
+            self._is_modified = False
+
+    def get_file(self, file_path: Path) -> IndexedFile:
+        """Returns the content and anchors of `file_path`, reading and parsing
+        the file only if it changed since it was indexed."""
+        path: str = os.path.abspath(file_path)
+        with self._lock:
+            if path in self._files:
+                return self._files[path]
+
+        stat = os.stat(path)
+        entry: Optional[dict] = self._entries.get(path)
+        indexed_file: IndexedFile
+        if (
+            entry is not None
+            and entry["mtime_ns"] == stat.st_mtime_ns
+            and entry["size"] == stat.st_size
+        ):
+            indexed_file = IndexedFile(
+                path,
+                {name: tuple(lines) for name, lines in entry["anchors"].items()},
+                entry["errors"],
+            )
+        else:
+            with open(path, "r") as text_file:
+                content: str = text_file.read()
+            content_hash: str = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            if entry is not None and entry["sha256"] == content_hash:
+                indexed_file = IndexedFile(
+                    path,
+                    {name: tuple(lines) for name, lines in entry["anchors"].items()},
+                    entry["errors"],
+                    content,
+                )
+            else:
+                indexed_file = IndexedFile.from_content(content, path)
+            entry = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "sha256": content_hash,
+                "anchors": indexed_file.anchors,
+                "errors": indexed_file.errors,
+            }
+            with self._lock:
+                self._entries[path] = entry
+                self._is_modified = True
+
+        with self._lock:
+            self._files[path] = indexed_file
+        return indexed_file
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""Generates a synthetic course and measures how long the build takes on it.
+
+The course has a configurable number of chapters, lessons, code blocks,
+include and link templates, pictures, and Godot projects with GDScript files.
+The program times each preprocessing step on every lesson, with a highlighter
+that doesn't run any external program, and optionally complete SCons builds.
+
+Results go to a JSON file. Pass a previous results file with --compare to
+print how much each measurement changed, for instance before and after a
+change or between two versions of the build system.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from html import escape
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import add_node_icons
+import highlight_code
+import include
+import link
+import table_of_contents
+from anchor_index import AnchorIndex
+from scons_helper import print_error
+
+PRODUCT_PACKAGER_DIRECTORY: Path = Path(__file__).parent
+RESULTS_VERSION: int = 1
+
+ERROR_SCONS_NOT_FOUND: int = 1
+ERROR_COMPARE_FILE_INVALID: int = 2
+
+# One-pixel PNG to use as pictures.
+PNG_DATA: bytes = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+NODE_NAMES: List[str] = ["Node2D", "Sprite", "Area2D", "Tween", "Camera2D", "Timer"]
+
+
+@dataclass
+class CourseParameters:
+    chapters: int = 5
+    lessons: int = 10
+    code_blocks: int = 8
+    includes: int = 4
+    links: int = 4
+    images: int = 4
+    projects: int = 2
+    scripts: int = 20
+
+
+class StubHighlighter:
+    """Highlighter that only escapes code, to measure the build without
+    chroma or pygments."""
+
+    name = "stub"
+
+    def get_version(self) -> str:
+        return "1"
+
+    def highlight_blocks(self, blocks: list) -> List[Optional[str]]:
+        return [f"<pre>{escape(block.code)}</pre>" for block in blocks]
+
+
+def get_lesson_name(chapter: int, lesson: int) -> str:
+    return f"Lesson{chapter}x{lesson}"
+
+
+def get_script_name(project: int, script: int) -> str:
+    return f"Script{project}x{script}.gd"
+
+
+def generate_script(name: str) -> str:
+    return "\n".join(
+        [
+            f"# {name}",
+            "extends Node2D",
+            "",
+            "# ANCHOR: variables",
+            "var speed := 500.0",
+            "var velocity := Vector2.ZERO",
+            "# END: variables",
+            "",
+            "# ANCHOR: physics",
+            "func _physics_process(delta: float) -> void:",
+            "\tvelocity = Vector2.RIGHT * speed",
+            "\tposition += velocity * delta",
+            "# END: physics",
+            "",
+        ]
+    )
+
+
+def generate_lesson(
+    parameters: CourseParameters, chapter: int, lesson: int, script_names: List[str]
+) -> str:
+    """Returns a lesson mixing prose, headings, and all the templates the build
+    processes."""
+    title: str = get_lesson_name(chapter, lesson)
+    lines: List[str] = [f"# {title}", "", "{% contents %}", ""]
+    for index in range(parameters.code_blocks):
+        node_name: str = NODE_NAMES[index % len(NODE_NAMES)]
+        lines += [
+            f"## Section {index}",
+            "",
+            f"Add a `{node_name}` node and attach a script to it. The `{node_name}` "
+            "moves every frame, so we update its position in `_physics_process()`.",
+            "",
+            "```gdscript",
+            "func _ready() -> void:",
+            f'\tprint("Section {index}")',
+            "```",
+            "",
+        ]
+        if script_names and index < parameters.includes:
+            script_index: int = (chapter + lesson + index) % len(script_names)
+            include_template: str = f"{{% include {script_names[script_index]} physics %}}"
+            lines += ["```gdscript", include_template, "```", ""]
+        if index < parameters.links:
+            other_lesson: int = (lesson + index + 1) % parameters.lessons
+            lines += [f"See {{% link {get_lesson_name(chapter, other_lesson)} %}}.", ""]
+        if index < parameters.images:
+            lines += [f"![Picture {index}](images/picture-{index}.png)", ""]
+    return "\n".join(lines)
+
+
+def generate_course(parameters: CourseParameters, directory: Path) -> None:
+    """Writes a course source directory with content and Godot projects."""
+    script_names: List[str] = []
+    for project in range(parameters.projects):
+        project_directory: Path = directory / "godot" / f"Project{project}"
+        project_directory.mkdir(parents=True, exist_ok=True)
+        (project_directory / "project.godot").write_text(
+            f'[application]\n\nconfig/name="Project {project}"\n'
+        )
+        for script in range(parameters.scripts):
+            name: str = get_script_name(project, script)
+            (project_directory / name).write_text(generate_script(name))
+            script_names.append(name)
+
+    for chapter in range(parameters.chapters):
+        chapter_name: str = f"{chapter:02}.chapter-{chapter}"
+        chapter_directory: Path = directory / "content" / chapter_name
+        images_directory: Path = chapter_directory / "images"
+        images_directory.mkdir(parents=True, exist_ok=True)
+        for index in range(parameters.images):
+            (images_directory / f"picture-{index}.png").write_bytes(PNG_DATA)
+        for lesson in range(parameters.lessons):
+            # The link template finds documents by file name.
+            lesson_name: str = get_lesson_name(chapter, lesson)
+            lesson_path: Path = chapter_directory / f"{lesson_name}.md"
+            lesson_path.write_text(
+                generate_lesson(parameters, chapter, lesson, script_names)
+            )
+
+    shutil.copy(
+        PRODUCT_PACKAGER_DIRECTORY / "to_copy" / "SConstruct", directory / "SConstruct"
+    )
+
+
+def measure(function: Callable[[], object], repeat: int) -> dict:
+    """Runs `function` `repeat` times and returns timings in seconds."""
+    runs: List[float] = []
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return {
+        "runs": runs,
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "mean": statistics.mean(runs),
+    }
+
+
+def benchmark_modules(directory: Path, repeat: int) -> Dict[str, dict]:
+    """Times each preprocessing step on all the lessons of the course."""
+    lesson_paths: List[Path] = sorted((directory / "content").glob("**/*.md"))
+    lessons: List[tuple] = [(path, path.read_text()) for path in lesson_paths]
+    project_files: List[Path] = sorted((directory / "godot").glob("**/*.gd"))
+    files_map, duplicate_files = include.find_duplicate_files(project_files)
+    anchor_index = AnchorIndex()
+    link_index = link.LinkIndex.from_files(directory / "content", lesson_paths)
+    highlighter = StubHighlighter()
+
+    steps: Dict[str, Callable[[Path, str], str]] = {
+        "include.process_document": lambda path, content: include.process_document(
+            content,
+            path,
+            files_map=files_map,
+            duplicate_files=duplicate_files,
+            anchor_index=anchor_index,
+        ),
+        "link.process_document": lambda path, content: link.process_document(
+            content, path, link_index
+        ),
+        "table_of_contents.replace_contents_template": lambda path, content: (
+            table_of_contents.replace_contents_template(content)
+        ),
+        "add_node_icons.add_built_in_icons": lambda path, content: (
+            add_node_icons.add_built_in_icons(content)
+        ),
+        "highlight_code.highlight_code_blocks": lambda path, content: (
+            highlight_code.highlight_code_blocks(content, None, highlighter)
+        ),
+    }
+    return {
+        name: measure(
+            lambda: [step(path, content) for path, content in lessons], repeat
+        )
+        for name, step in steps.items()
+    }
+
+
+def run_scons(directory: Path, scons_arguments: List[str]) -> None:
+    environment: dict = dict(
+        os.environ, PATH_TO_PRODUCT_PACKAGER=str(PRODUCT_PACKAGER_DIRECTORY.resolve())
+    )
+    subprocess.run(
+        ["scons", "-Q"] + scons_arguments,
+        cwd=directory,
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+
+def benchmark_scons(
+    directory: Path, repeat: int, scons_arguments: List[str]
+) -> Dict[str, dict]:
+    """Times complete builds from a clean directory and builds with nothing to
+    do."""
+
+    def build_from_scratch() -> None:
+        run_scons(directory, ["-c"] + scons_arguments)
+        run_scons(directory, scons_arguments)
+
+    return {
+        "scons.clean_build": measure(build_from_scratch, repeat),
+        "scons.no_op_build": measure(
+            lambda: run_scons(directory, scons_arguments), repeat
+        ),
+    }
+
+
+def get_git_revision() -> str:
+    result = subprocess.run(
+        ["git", "rev-parse", "HEAD"],
+        cwd=PRODUCT_PACKAGER_DIRECTORY,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+def compare_results(previous: dict, current: dict) -> str:
+    """Returns a table of the median time of each measurement in both runs."""
+    lines: List[str] = [f"{'benchmark':<45} {'before':>9} {'after':>9} {'change':>8}"]
+    for name, result in current["results"].items():
+        if name not in previous["results"]:
+            continue
+        before: float = previous["results"][name]["median"]
+        after: float = result["median"]
+        change: float = 100.0 * (after - before) / before if before else 0.0
+        lines.append(f"{name:<45} {before:>9.4f} {after:>9.4f} {change:>+7.1f}%")
+    return "\n".join(lines)
+
+
+def get_args(args) -> argparse.Namespace:
+    """Parses the command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    defaults = CourseParameters()
+    for name, value in asdict(defaults).items():
+        parser.add_argument(
+            "--" + name.replace("_", "-"),
+            type=int,
+            default=value,
+            help=f"Number of {name.replace('_', ' ')}. Default: {value}.",
+        )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="Times to run each benchmark."
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=Path("benchmark.json"),
+        help="Path to the JSON results file.",
+    )
+    parser.add_argument(
+        "--directory",
+        type=Path,
+        default=None,
+        help="Generate the course in this directory and keep it. Default: a temporary one.",
+    )
+    parser.add_argument(
+        "--scons",
+        action="store_true",
+        help="Also time complete SCons builds. Requires SCons and pandoc.",
+    )
+    parser.add_argument(
+        "--scons-arguments",
+        type=str,
+        default="--no-cache",
+        help="Extra arguments for SCons builds. Default: --no-cache.",
+    )
+    parser.add_argument(
+        "--compare",
+        type=Path,
+        default=None,
+        help="Path to a previous results file to compare against.",
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args: argparse.Namespace = get_args(sys.argv[1:])
+    parameters = CourseParameters(
+        **{name: getattr(args, name) for name in asdict(CourseParameters())}
+    )
+    if args.scons and shutil.which("scons") is None:
+        print_error("SCons not found, install it to benchmark complete builds.")
+        sys.exit(ERROR_SCONS_NOT_FOUND)
+
+    directory: Path = args.directory or Path(tempfile.mkdtemp(prefix="course-"))
+    try:
+        generate_course(parameters, directory)
+        results: Dict[str, dict] = benchmark_modules(directory, args.repeat)
+        if args.scons:
+            results.update(
+                benchmark_scons(directory, args.repeat, args.scons_arguments.split())
+            )
+    finally:
+        if args.directory is None:
+            shutil.rmtree(directory)
+
+    output: dict = {
+        "version": RESULTS_VERSION,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_revision": get_git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": asdict(parameters),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(output, output_file, indent=2)
+
+    for name, result in results.items():
+        print(f"{name:<45} {result['median']:.4f}s")
+    if args.compare is not None:
+        try:
+            with open(args.compare, "r") as compare_file:
+                previous: dict = json.load(compare_file)
+        except (OSError, ValueError) as error:
+            print_error(f"Couldn't read {args.compare}: {error}")
+            sys.exit(ERROR_COMPARE_FILE_INVALID)
+        print()
+        print(compare_results(previous, output))
+
+
+if __name__ == "__main__":
+    main()
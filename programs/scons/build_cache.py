@@ -0,0 +1,238 @@
+"""On-disk, content-addressed cache shared by the build steps.
+
+Entries are stored as one file per key under the cache directory. Keys are
+tuples of strings that get hashed together, so callers put everything that
+affects the cached output in the key: the input text, program versions, styles,
+etc.
+
+The cache has a maximum size. When it grows past that size, the least recently
+used entries get deleted first. Reading an entry marks it as used.
+"""
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Iterator, Optional, Sequence
+
+ENV_CACHE_DIRECTORY: str = "PRODUCT_PACKAGER_CACHE_DIR"
+DEFAULT_MAX_SIZE: int = 512 * 1024 * 1024
+# When evicting, we delete entries until the cache is below this fraction of
+# its maximum size to avoid evicting again on the next write.
+EVICTION_TARGET_RATIO: float = 0.8
+
+
+PROC_STATUS_PATH: str = "/proc/self/status"
+
+_umask: Optional[int] = None
+_umask_lock = threading.Lock()
+
+
+def get_umask() -> int:
+    """Returns the umask of the process, read once.
+
+    os.umask() can only read the umask by changing it, which would affect files
+    that other threads create in the meantime. On Linux, we read it from /proc
+    instead."""
+    global _umask
+    with _umask_lock:
+        if _umask is None:
+            try:
+                with open(PROC_STATUS_PATH, "r") as status_file:
+                    for line in status_file:
+                        if line.startswith("Umask:"):
+                            _umask = int(line.split()[1], 8)
+                            break
+            except OSError:
+                pass
+            if _umask is None:
+                _umask = os.umask(0)
+                os.umask(_umask)
+        return _umask
+
+
+@contextmanager
+def open_file_atomically(file_path: Path, mode: str = "wb") -> Iterator[IO]:
+    """Opens a temporary file next to `file_path` for writing and moves it to
+    `file_path` once the `with` block completes, so readers never see a
+    partially written file."""
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=file_path.parent)
+    try:
+        # Temporary files are only readable by their owner. We give files
+        # written atomically the same permissions as files created with open().
+        os.chmod(temporary_path, 0o666 & ~get_umask())
+        with os.fdopen(file_descriptor, mode) as output_file:
+            yield output_file
+        os.replace(temporary_path, file_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def write_file_atomically(file_path: Path, data: bytes) -> None:
+    """Writes `data` to `file_path` with `open_file_atomically()`."""
+    with open_file_atomically(file_path) as output_file:
+        output_file.write(data)
+
+
+def get_default_cache_directory() -> Path:
+    """Returns the directory to store caches in.
+
+    Uses the PRODUCT_PACKAGER_CACHE_DIR environment variable if set, otherwise
+    the user's cache directory."""
+    if os.environ.get(ENV_CACHE_DIRECTORY):
+        return Path(os.environ[ENV_CACHE_DIRECTORY])
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME", "")
+    base_directory = Path(xdg_cache_home) if xdg_cache_home else Path.home() / ".cache"
+    return base_directory / "product-packager"
+
+
+def hash_text(text: str) -> str:
+    """Returns the sha256 hexdigest of `text`."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _hash_file(path: str, mtime_ns: int, size: int) -> str:
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    """Returns the sha256 hexdigest of the file at `path`, or an empty string if
+    the file doesn't exist.
+
+    Hashes each version of a file only once per process."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ""
+    return _hash_file(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def hash_directory(directory: Path) -> str:
+    """Returns a hash of the relative paths and contents of all files in
+    `directory`."""
+    directory_hash = hashlib.sha256()
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path: str = os.path.join(root, filename)
+            directory_hash.update(os.path.relpath(path, directory).encode("utf-8"))
+            directory_hash.update(hash_file(Path(path)).encode("utf-8"))
+    return directory_hash.hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+
+class DiskCache:
+    """Stores bytes on disk, addressed by a key made of strings."""
+
+    def __init__(self, directory: Path, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.directory: Path = Path(directory)
+        self.max_size: int = max_size
+        self.stats = CacheStats()
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def get_entry_path(self, key: Sequence[str]) -> Path:
+        digest: str = hashlib.sha256("\0".join(key).encode("utf-8")).hexdigest()
+        return self.directory / digest[:2] / digest
+
+    def get(self, key: Sequence[str]) -> Optional[bytes]:
+        """Returns the cached data for `key` or `None` if there's no entry."""
+        path: Path = self.get_entry_path(key)
+        try:
+            with open(path, "rb") as entry:
+                data: bytes = entry.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.stats.misses += 1
+            return None
+        with self._lock:
+            self.stats.hits += 1
+        return data
+
+    def get_text(self, key: Sequence[str]) -> Optional[str]:
+        data = self.get(key)
+        return data.decode("utf-8") if data is not None else None
+
+    def set(self, key: Sequence[str], data: bytes) -> None:
+        """Stores `data` for `key`, evicting old entries if the cache is full."""
+        path: Path = self.get_entry_path(key)
+        try:
+            replaced_size: int = os.stat(path).st_size
+        except OSError:
+            replaced_size = 0
+        # Concurrent builds never read a partially written entry.
+        write_file_atomically(path, data)
+
+        with self._lock:
+            self.stats.writes += 1
+            if self._size is None:
+                self._size = self._calculate_size()
+            else:
+                self._size += len(data) - replaced_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def set_text(self, key: Sequence[str], text: str) -> None:
+        self.set(key, text.encode("utf-8"))
+
+    def _list_entries(self) -> list:
+        """Returns a list of (access time, size, path) tuples for all entries."""
+        entries: list = []
+        if not self.directory.exists():
+            return entries
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _calculate_size(self) -> int:
+        return sum(size for _, size, _ in self._list_entries())
+
+    def _evict(self) -> None:
+        """Deletes the least recently used entries until the cache is small
+        enough. Must be called with the lock held."""
+        target_size: int = int(self.max_size * EVICTION_TARGET_RATIO)
+        entries: list = sorted(self._list_entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= target_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+            self.stats.evictions += 1
+
+    def format_stats(self, name: str) -> str:
+        """Returns a one-line report of the cache's usage."""
+        lookups: int = self.stats.hits + self.stats.misses
+        hit_rate: float = 100.0 * self.stats.hits / lookups if lookups else 0.0
+        size: int = self._size if self._size is not None else self._calculate_size()
+        return (
+            f"{name} cache: {self.stats.hits}/{lookups} hits ({hit_rate:.1f}%), "
+            f"{self.stats.writes} writes, {self.stats.evictions} evictions, "
+            f"{size / 1024 / 1024:.1f}/{self.max_size / 1024 / 1024:.0f} MB"
+        )
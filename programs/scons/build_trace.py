@@ -0,0 +1,162 @@
+"""Records how long each step of the build takes.
+
+The build wraps its steps in spans: finding source files, packaging Godot
+projects, each preprocessing stage of each lesson, pandoc, and preparing files
+for Mavenseed. Each span records its wall time, the CPU time of the thread
+that ran it, and optionally how many bytes it read and wrote.
+
+Tracing is opt-in. When the tracer is disabled, spans don't record anything.
+
+The tracer writes spans in the Chrome trace event format, which you can open
+in chrome://tracing or https://ui.perfetto.dev, and prints a summary of the
+slowest lessons and stages.
+
+Note that the CPU time doesn't include child processes like pandoc or chroma:
+their cost shows in the wall time of the span that runs them.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+# Categories of spans, used to group them in the summary.
+CATEGORY_SETUP: str = "setup"
+CATEGORY_LESSON: str = "lesson"
+CATEGORY_STAGE: str = "stage"
+CATEGORY_GODOT: str = "godot"
+CATEGORY_MAVENSEED: str = "mavenseed"
+
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    # Lesson or project the span processed, if any.
+    subject: str = ""
+    start: float = 0.0
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    thread_id: int = 0
+
+    def to_trace_event(self, start_time: float) -> dict:
+        return {
+            "name": f"{self.name}: {self.subject}" if self.subject else self.name,
+            "cat": self.category,
+            "ph": "X",
+            "ts": (self.start - start_time) * 1e6,
+            "dur": self.wall_time * 1e6,
+            "pid": os.getpid(),
+            "tid": self.thread_id,
+            "args": {
+                "subject": self.subject,
+                "cpu_ms": round(self.cpu_time * 1000, 3),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+            },
+        }
+
+
+@dataclass
+class SpanTotals:
+    """Sum of the spans sharing a name or a subject."""
+
+    count: int = 0
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+    def add(self, span: Span) -> None:
+        self.count += 1
+        self.wall_time += span.wall_time
+        self.cpu_time += span.cpu_time
+        self.bytes_in += span.bytes_in
+        self.bytes_out += span.bytes_out
+
+
+def sum_spans(spans: List[Span], by_subject: bool) -> Dict[str, SpanTotals]:
+    totals: Dict[str, SpanTotals] = {}
+    for span in spans:
+        key: str = span.subject if by_subject else span.name
+        totals.setdefault(key, SpanTotals()).add(span)
+    return totals
+
+
+def format_table(title: str, totals: Dict[str, SpanTotals], count: int) -> str:
+    """Returns a text table of the `count` entries with the longest wall time."""
+    rows: list = sorted(totals.items(), key=lambda item: item[1].wall_time, reverse=True)
+    width: int = max([len(title)] + [len(name) for name, _ in rows[:count]])
+    lines: List[str] = [
+        f"{title:<{width}}  {'calls':>6}  {'wall s':>8}  {'cpu s':>8}  "
+        f"{'in KB':>9}  {'out KB':>9}"
+    ]
+    for name, total in rows[:count]:
+        lines.append(
+            f"{name:<{width}}  {total.count:>6}  {total.wall_time:>8.3f}  "
+            f"{total.cpu_time:>8.3f}  {total.bytes_in / 1024:>9.1f}  "
+            f"{total.bytes_out / 1024:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+class Tracer:
+    """Collects spans from all the threads of a build."""
+
+    def __init__(self, is_enabled: bool = False) -> None:
+        self.is_enabled: bool = is_enabled
+        self.spans: List[Span] = []
+        self.start_time: float = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, category: str, subject: str = "") -> Iterator[Span]:
+        """Times the code in the `with` block.
+
+        Set `bytes_in` and `bytes_out` on the yielded span to record the size
+        of the step's input and output."""
+        span = Span(name, category, str(subject))
+        if not self.is_enabled:
+            yield span
+            return
+
+        span.thread_id = threading.get_ident()
+        span.start = time.perf_counter()
+        cpu_start: float = time.thread_time()
+        try:
+            yield span
+        finally:
+            span.wall_time = time.perf_counter() - span.start
+            span.cpu_time = time.thread_time() - cpu_start
+            with self._lock:
+                self.spans.append(span)
+
+    def write_chrome_trace(self, output_path: Path) -> None:
+        """Writes the spans as a Chrome trace event JSON file."""
+        with self._lock:
+            events: List[dict] = [
+                span.to_trace_event(self.start_time) for span in self.spans
+            ]
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, "w") as output_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, output_file)
+
+    def format_summary(self, count: int = 10) -> str:
+        """Returns tables of the slowest lessons and of the total time spent in
+        each stage."""
+        with self._lock:
+            spans: List[Span] = list(self.spans)
+        lessons: List[Span] = [s for s in spans if s.category == CATEGORY_LESSON]
+        stages: List[Span] = [s for s in spans if s.category != CATEGORY_LESSON]
+        tables: List[str] = [
+            format_table("Stage", sum_spans(stages, False), len(stages)),
+            format_table(
+                f"Slowest lessons (top {count})", sum_spans(lessons, True), count
+            ),
+        ]
+        return "\n\n".join(tables)
@@ -18,16 +18,27 @@
 # Description:
 #
 # Converts markdown documents to self-contained HTML or PDF files using Pandoc.
+#
+# Several documents convert in parallel. To convert many documents with
+# custom output paths at once, pass a manifest: a JSON file containing a list
+# of {"input": "path/to/file.md", "output": "path/to/file.html"} objects.
+import functools
+import json
 import logging
 import re
 import subprocess
+import sys
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
-from typing import Sequence
+from typing import List, Optional, Sequence, Tuple
 
 from datargs import arg, parse
 
+from build_cache import DiskCache, hash_directory, hash_file, hash_text
+from markdown_dependencies import find_media_references
+from pandoc_runner import PandocError, PandocJob, PandocRunner
+
 
 class PdfEngines(Enum):
     pdfroff = "pdfroff"
@@ -48,6 +59,7 @@ CONTENT_DIRECTORY: str = "content"
 DEFAULT_CSS_FILE_PATH: Path = Path(THIS_DIRECTORY, "css/pandoc.css")
 DEFAULT_DATA_DIRECTORY: Path = Path(THIS_DIRECTORY, "pandoc")
 
+ERROR_CONVERSION_FAILED: int = 1
 ERROR_CSS_INVALID: str = (
     "Invalid CSS file. {} is not a valid file. Using default path {}."
 )
@@ -88,6 +100,16 @@ class Args:
         aliases=["-f"],
         help="List of pandoc filters to run on each content file.",
     )
+    manifest: Optional[Path] = arg(
+        default=None,
+        aliases=["-m"],
+        help="Path to a JSON file listing input and output paths to convert.",
+    )
+    jobs: int = arg(
+        default=0,
+        aliases=["-j"],
+        help="Number of documents to convert in parallel. Default: based on CPU and memory.",
+    )
 
 
 def path_to_title(filepath: str) -> str:
@@ -105,13 +127,22 @@ def get_output_path(args: Args, filepath: Path) -> Path:
     return Path(args.output_directory, directory_name, filename)
 
 
-def convert_markdown(args: Args, path: str) -> None:
-    """Builds and runs a pandoc command to convert the input markdown document
-    `path` to the desired output format."""
+def read_manifest(manifest_path: Path) -> List[Tuple[Path, Path]]:
+    """Returns the list of (input, output) paths in a manifest file. Relative
+    paths are relative to the manifest."""
+    with open(manifest_path, "r") as manifest_file:
+        entries: list = json.load(manifest_file)
+    directory: Path = manifest_path.parent
+    return [
+        (directory / entry["input"], directory / entry["output"]) for entry in entries
+    ]
+
+
+def get_pandoc_options(args: Args, path: Path) -> List[str]:
+    """Returns the pandoc command line options to convert the markdown document
+    `path`, without input and output files."""
     title: str = path_to_title(path)
-    pandoc_command = [
-        "pandoc",
-        path.absolute().as_posix(),
+    pandoc_options = [
         "--self-contained",
         "--css",
         args.css.absolute().as_posix(),
@@ -121,33 +152,164 @@ def convert_markdown(args: Args, path: str) -> None:
         args.pandoc_data_directory.absolute().as_posix(),
     ]
     if args.output_type == OutputTypes.pdf:
-        pandoc_command += ["--pdf-engine", args.pdf_engine]
+        pandoc_options += ["--pdf-engine", args.pdf_engine]
     if args.filters:
-        pandoc_command += ["--filter", *args.filters]
-    output_path: Path = get_output_path(args, path)
-    pandoc_command += ["--output", output_path.absolute().as_posix()]
+        pandoc_options += ["--filter", *args.filters]
     # To use pandoc's built-in syntax highlighter. The theme still needs some work.
     # PANDOC_DIRECTORY: Path = Path(THIS_DIRECTORY, "pandoc")
-    # pandoc_command += [
+    # pandoc_options += [
     # "--syntax-definition",
     # Path(PANDOC_DIRECTORY, "gd-script.xml").absolute().as_posix(),
     # "--highlight-style",
     # Path(PANDOC_DIRECTORY, "gdscript.theme").absolute().as_posix()
     # ]
+    return pandoc_options
+
+
+def get_pandoc_job(
+    args: Args, path: Path, output_path: Optional[Path] = None
+) -> PandocJob:
+    """Builds the pandoc command to convert the input markdown document `path`
+    to the desired output format.
+
+    The output file goes to `output_path` if set, otherwise to a path
+    calculated from the command line arguments."""
+    if output_path is None:
+        output_path = get_output_path(args, path)
+    pandoc_command = (
+        ["pandoc", path.absolute().as_posix()]
+        + get_pandoc_options(args, path)
+        + ["--output", output_path.absolute().as_posix()]
+    )
+    return PandocJob(pandoc_command, cwd=path.parent, name=str(path))
+
+
+def get_pandoc_pipe_job(args: Args, path: Path, content: str) -> PandocJob:
+    """Builds a pandoc job that reads the markdown `content` from its standard
+    input and writes the converted document to its standard output.
+
+    `path` is the location of the document, used for its title and to find the
+    pictures and videos it references."""
+    pandoc_command = (
+        ["pandoc"]
+        + get_pandoc_options(args, path)
+        + ["--resource-path", path.parent.absolute().as_posix()]
+    )
+    return PandocJob(
+        pandoc_command, cwd=path.parent, input=content.encode("utf-8"), name=str(path)
+    )
+
+
+def convert_markdown(
+    args: Args, path: Path, runner: Optional[PandocRunner] = None
+) -> None:
+    """Converts the input markdown document `path` to the desired output
+    format with pandoc.
+
+    If you pass a `runner`, the pandoc process waits for a free slot in it."""
+    if runner is None:
+        runner = PandocRunner(max_jobs=1)
 
+    output_path: Path = get_output_path(args, path)
     if not output_path.parent.exists():
-        output_path.parent.mkdir(parents=True)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    result = runner.run(get_pandoc_job(args, path))
+    if not result.succeeded:
+        raise PandocError(result)
+
+
+@functools.lru_cache(maxsize=None)
+def get_pandoc_version() -> str:
+    out = subprocess.run(["pandoc", "--version"], capture_output=True, text=True)
+    return out.stdout.split("\n", 1)[0]
+
+
+@functools.lru_cache(maxsize=None)
+def hash_pandoc_data_directory(directory: Path) -> str:
+    return hash_directory(directory)
 
-    out = subprocess.run(pandoc_command, capture_output=True, cwd=path.parent)
-    if out.returncode != 0:
-        print(out.stderr.decode())
-        raise Exception(out.stderr.decode())
+
+def get_render_cache_key(args: Args, path: Path, content: str) -> Tuple[str, ...]:
+    """Returns a key identifying everything that affects the output of
+    `render_markdown()`: the content, the styles, pandoc's version and data
+    files, and the pictures and videos embedded in the document.
+
+    The key doesn't depend on the location of the project, so the cache can be
+    shared between checkouts."""
+    media_hashes: List[str] = [
+        media_path + ":" + hash_file(path.parent / media_path)
+        for media_path in find_media_references(content)
+    ]
+    return (
+        "pandoc",
+        get_pandoc_version(),
+        path_to_title(path),
+        args.output_type.value,
+        " ".join(args.filters),
+        hash_text(content),
+        hash_file(args.css),
+        hash_pandoc_data_directory(args.pandoc_data_directory.absolute()),
+        *media_hashes,
+    )
+
+
+def render_markdown(
+    args: Args,
+    path: Path,
+    content: str,
+    runner: Optional[PandocRunner] = None,
+    cache: Optional[DiskCache] = None,
+) -> bytes:
+    """Converts the markdown `content` of the document at `path` in memory and
+    returns the output of pandoc.
+
+    If you pass a `cache`, documents that were already rendered with the same
+    inputs come from the cache instead of running pandoc."""
+    key: Tuple[str, ...] = ()
+    if cache is not None:
+        key = get_render_cache_key(args, path, content)
+        cached: Optional[bytes] = cache.get(key)
+        if cached is not None:
+            return cached
+
+    if runner is None:
+        runner = PandocRunner(max_jobs=1)
+
+    result = runner.run(get_pandoc_pipe_job(args, path, content))
+    if not result.succeeded:
+        raise PandocError(result)
+    if cache is not None:
+        cache.set(key, result.stdout)
+    return result.stdout
+
+
+def convert_many(
+    args: Args, paths: Sequence[Tuple[Path, Path]], runner: PandocRunner
+) -> bool:
+    """Converts all the (input, output) `paths` concurrently. Returns `True`
+    if all conversions succeeded."""
+    for _, output_path in paths:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+    jobs: List[PandocJob] = [
+        get_pandoc_job(args, path, output_path) for path, output_path in paths
+    ]
+    results = runner.run_all(jobs)
+    return all(result.succeeded for result in results)
 
 
 def main():
     args: Args = parse(Args)
-    for filepath in args.files:
-        convert_markdown(args, filepath)
+    paths: List[Tuple[Path, Path]] = [
+        (path, get_output_path(args, path)) for path in args.files
+    ]
+    if args.manifest is not None:
+        paths += read_manifest(args.manifest)
+
+    runner = PandocRunner(args.jobs)
+    if not convert_many(args, paths, runner):
+        LOGGER.error("Failed to convert {} files.".format(len(runner.errors)))
+        sys.exit(ERROR_CONVERSION_FAILED)
 
 
 if __name__ == "__main__":
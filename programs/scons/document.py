@@ -0,0 +1,167 @@
+"""Block-level model of a markdown document, shared by the preprocessing steps.
+
+The build parses each document once into a list of blocks. Each
+preprocessing step then transforms the blocks it cares about, and the build
+serializes the document once at the end. This avoids re-splitting the text on
+code fences in every step, and all steps agree on what is a code block.
+
+Serializing a document that no step modified returns the original text.
+"""
+import re
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Iterator, List, Tuple
+
+RE_HEADING: re.Pattern = re.compile(r"^(#+)(.+)$")
+RE_TEMPLATE: re.Pattern = re.compile(r"^{%.*%}$")
+RE_LINE: re.Pattern = re.compile(r"[^\n]*\n|[^\n]+")
+# Backtick fences can't have backticks in their info string.
+RE_FENCE: re.Pattern = re.compile(r"^ {0,3}(?P<fence>`{3,}(?=[^`]*$)|~{3,})")
+# First word of a fence's info string, like `gdscript` in ```gdscript or
+# ```{.gdscript}.
+RE_FENCE_LANGUAGE: re.Pattern = re.compile(r"^[ \t]*{?[ \t]*\.?(?P<language>[^\s{}.]*)")
+
+
+class BlockTypes(Enum):
+    # Markdown prose.
+    text = "text"
+    # Fenced code block. The block's text is the code between the fences.
+    code = "code"
+    # A line starting with #.
+    heading = "heading"
+    # A line containing only a template like {% contents %}.
+    template = "template"
+    # Raw HTML output by a preprocessing step, like highlighted code.
+    html = "html"
+
+
+@dataclass
+class Block:
+    type: BlockTypes
+    text: str
+    # Language of code blocks, as written after the opening fence.
+    language: str = ""
+    # Line break after heading and template lines and after the closing fence
+    # of code blocks, empty at the end of the document.
+    line_end: str = ""
+    # Opening fence line of code blocks, with its line break, and closing fence
+    # without its line break. The closing fence is empty if the code block
+    # runs to the end of the document.
+    opening_fence: str = ""
+    closing_fence: str = ""
+
+    def to_markdown(self) -> str:
+        if self.type == BlockTypes.code:
+            return self.opening_fence + self.text + self.closing_fence + self.line_end
+        return self.text + self.line_end
+
+
+def is_closing_fence(line: str, fence: str) -> bool:
+    """Returns `True` if `line` closes a code block opened with `fence`."""
+    match = RE_FENCE.match(line)
+    return bool(
+        match
+        and match.group("fence")[0] == fence[0]
+        and len(match.group("fence")) >= len(fence)
+        and not line[match.end() :].strip()
+    )
+
+
+def split_fenced_code(content: str) -> Iterator[Tuple[str, bool]]:
+    """Yields the consecutive parts of `content` and whether each part is a
+    fenced code block, fences included.
+
+    Fences are lines starting with at least three backticks or tildes, with any
+    info string, like ```GDScript. A code block ends with a fence of the same
+    character that is at least as long, or at the end of the document."""
+    part: List[str] = []
+    fence: str = ""
+    for line in RE_LINE.findall(content):
+        stripped_line: str = line.rstrip("\r\n")
+        if fence:
+            part.append(line)
+            if is_closing_fence(stripped_line, fence):
+                yield "".join(part), True
+                part, fence = [], ""
+            continue
+        match = RE_FENCE.match(stripped_line)
+        if match:
+            if part:
+                yield "".join(part), False
+            part, fence = [line], match.group("fence")
+            continue
+        part.append(line)
+    if part:
+        yield "".join(part), bool(fence)
+
+
+def parse_code(text: str) -> Block:
+    """Returns the code block made of the fenced code `text`."""
+    lines: List[str] = RE_LINE.findall(text)
+    opening_fence: str = lines[0]
+    fence: str = RE_FENCE.match(opening_fence).group("fence")
+    info_string: str = opening_fence.rstrip("\r\n")[
+        opening_fence.index(fence) + len(fence) :
+    ]
+    language: str = RE_FENCE_LANGUAGE.match(info_string).group("language")
+    closing_fence, line_end = "", ""
+    if len(lines) > 1 and is_closing_fence(lines[-1].rstrip("\r\n"), fence):
+        last_line: str = lines.pop()
+        closing_fence = last_line.rstrip("\r\n")
+        line_end = last_line[len(closing_fence) :]
+    return Block(
+        BlockTypes.code,
+        "".join(lines[1:]),
+        language,
+        line_end=line_end,
+        opening_fence=opening_fence,
+        closing_fence=closing_fence,
+    )
+
+
+def parse_prose(text: str) -> Iterator[Block]:
+    """Splits prose into text, heading, and template blocks."""
+    text_lines: List[str] = []
+    for line in RE_LINE.findall(text):
+        stripped_line: str = line.rstrip("\n")
+        block_type = None
+        if RE_HEADING.match(stripped_line):
+            block_type = BlockTypes.heading
+        elif RE_TEMPLATE.match(stripped_line):
+            block_type = BlockTypes.template
+
+        if block_type is None:
+            text_lines.append(line)
+            continue
+        if text_lines:
+            yield Block(BlockTypes.text, "".join(text_lines))
+            text_lines = []
+        yield Block(block_type, stripped_line, line_end=line[len(stripped_line) :])
+    if text_lines:
+        yield Block(BlockTypes.text, "".join(text_lines))
+
+
+@dataclass
+class Document:
+    blocks: List[Block] = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, content: str) -> "Document":
+        blocks: List[Block] = []
+        for part, is_code in split_fenced_code(content):
+            if is_code:
+                blocks.append(parse_code(part))
+            else:
+                blocks += parse_prose(part)
+        return cls(blocks)
+
+    def serialize(self) -> str:
+        return "".join(block.to_markdown() for block in self.blocks)
+
+    def get_blocks(self, *block_types: BlockTypes) -> List[Block]:
+        """Returns the blocks of the given types, in order."""
+        return [block for block in self.blocks if block.type in block_types]
+
+    def get_prose_blocks(self) -> List[Block]:
+        """Returns all the blocks that are neither code nor HTML."""
+        return self.get_blocks(BlockTypes.text, BlockTypes.heading, BlockTypes.template)
@@ -0,0 +1,140 @@
+"""Assembles the lessons of a chapter into one markdown document for the Epub
+build.
+
+Each lesson's headings move one level down so the chapter's title is the
+only level-1 heading. We shift headings in Python instead of running pandoc
+with --shift-heading-level-by on every lesson, and stream lessons to the
+output one at a time.
+"""
+import re
+from pathlib import Path
+from typing import IO, Callable, Dict, Iterable, List, Optional, Tuple
+
+from document import RE_LINE, split_fenced_code
+from image_index import rename_references
+
+# Markdown only has six levels of headings.
+MAX_HEADING_LEVEL: int = 6
+
+RE_ATX_HEADING: re.Pattern = re.compile(
+    r"^(?P<indent> {0,3})(?P<level>#{1,6})(?P<text>(?:[ \t].*)?)$"
+)
+RE_ATX_CLOSING_SEQUENCE: re.Pattern = re.compile(r"(?:^|[ \t]+)#+[ \t]*$")
+RE_SETEXT_UNDERLINE: re.Pattern = re.compile(r"^ {0,3}(?P<underline>=+|-+)[ \t]*$")
+# Lines that start a block other than a paragraph, so they can't be the text of
+# a setext heading: list items, quotes, tables, HTML, templates, and
+# thematic breaks.
+RE_NOT_PARAGRAPH: re.Pattern = re.compile(
+    r"^ {0,3}(?:[-*+][ \t]|\d+[.)][ \t]|>|\||<|{%|(?:[-*_][ \t]*){3,}$)"
+)
+RE_YAML_DELIMITER: re.Pattern = re.compile(r"^(?:---|\.\.\.)[ \t]*$")
+
+
+def split_front_matter(content: str) -> Tuple[str, str]:
+    """Returns the YAML front matter of `content`, if any, and the rest of
+    `content`."""
+    lines: List[str] = RE_LINE.findall(content)
+    if not lines or not RE_YAML_DELIMITER.match(lines[0].rstrip("\r\n")):
+        return "", content
+    for index in range(1, len(lines)):
+        if RE_YAML_DELIMITER.match(lines[index].rstrip("\r\n")):
+            return "".join(lines[: index + 1]), "".join(lines[index + 1 :])
+    return "", content
+
+
+def transform_prose(content: str, transform: Callable[[str], str]) -> str:
+    """Returns `content` with `transform` applied to the parts outside fenced
+    code blocks."""
+    return "".join(
+        part if is_code else transform(part)
+        for part, is_code in split_fenced_code(content)
+    )
+
+
+def make_heading(level: int, text: str, line_end: str) -> List[str]:
+    """Returns the lines of a heading of `level` with the content `text`.
+
+    Like pandoc, turns headings deeper than the maximum level into
+    paragraphs."""
+    if level <= MAX_HEADING_LEVEL:
+        return ["#" * level + " " + text + line_end]
+    return ["\n", text + line_end, "\n"]
+
+
+def shift_prose_headings(prose: str, offset: int) -> str:
+    """Returns `prose`, markdown without code blocks, with `offset` levels added
+    to its ATX and setext headings."""
+    output: List[str] = []
+    # Lines of the paragraph before the current line, which a setext
+    # underline turns into a heading.
+    paragraph: List[str] = []
+    for line in RE_LINE.findall(prose):
+        stripped_line: str = line.rstrip("\r\n")
+        line_end: str = line[len(stripped_line) :]
+        heading_match = RE_ATX_HEADING.match(stripped_line)
+        underline_match = RE_SETEXT_UNDERLINE.match(stripped_line)
+        if heading_match and not paragraph:
+            level: int = len(heading_match.group("level")) + offset
+            if level > MAX_HEADING_LEVEL:
+                text: str = RE_ATX_CLOSING_SEQUENCE.sub("", heading_match.group("text"))
+                output += make_heading(level, text.strip(), line_end)
+            else:
+                output.append(
+                    heading_match.group("indent")
+                    + "#" * level
+                    + heading_match.group("text")
+                    + line_end
+                )
+        elif underline_match and paragraph:
+            level = (1 if underline_match.group("underline")[0] == "=" else 2) + offset
+            text = " ".join(paragraph_line.strip() for paragraph_line in paragraph)
+            del output[-len(paragraph) :]
+            output += make_heading(level, text, line_end)
+            paragraph = []
+        elif stripped_line.strip() and (paragraph or not RE_NOT_PARAGRAPH.match(line)):
+            paragraph.append(line)
+            output.append(line)
+        else:
+            paragraph = []
+            output.append(line)
+    return "".join(output)
+
+
+def shift_headings(content: str, offset: int = 1) -> str:
+    """Returns `content` with `offset` levels added to all headings outside
+    fenced code blocks and the YAML front matter.
+
+    Follows pandoc's markdown rules: ATX headings need a space after the `#`
+    characters and a blank line before them, and the text of setext headings
+    can't be a list item, a quote, or a table. Headings nested in lists and
+    quotes stay as they are."""
+    front_matter, body = split_front_matter(content)
+    return front_matter + transform_prose(
+        body, lambda prose: shift_prose_headings(prose, offset)
+    )
+
+
+def write_chapter(
+    output_file: IO,
+    title: str,
+    lesson_paths: Iterable[Path],
+    image_renames: Optional[Dict[str, str]] = None,
+) -> int:
+    """Writes a chapter titled `title` with the content of all lessons, in
+    order. Returns the number of characters written.
+
+    `image_renames` maps picture names to the name of an identical picture
+    to use instead."""
+    size: int = output_file.write("# " + title + "\n")
+    for lesson_path in lesson_paths:
+        with open(lesson_path, "r") as lesson_file:
+            content: str = shift_headings(lesson_file.read())
+        if image_renames:
+            content = transform_prose(
+                content, lambda prose: rename_references(prose, image_renames)
+            )
+        # Headings need a blank line before them, so lessons can't touch.
+        size += output_file.write("\n" + content)
+        if not content.endswith("\n"):
+            size += output_file.write("\n")
+    return size
@@ -0,0 +1,555 @@
+"""Assembles an EPUB 3 book from chapters rendered one at a time.
+
+Pandoc renders each chapter to its own XHTML document, and we write the OCF
+container ourselves: the mimetype, container.xml, the OPF package document,
+the navigation document, and the stylesheet, cover, and pictures. So changing
+one lesson renders one chapter again and re-zips the book, instead of
+rendering the whole book with pandoc.
+
+Pandoc has no XHTML writer for single documents and passes raw HTML through
+unchanged, so we parse each rendered chapter and write it again as
+well-formed XHTML.
+
+Rendered chapters go to a `DiskCache`, keyed by their content, so switching
+branches doesn't render unchanged chapters again either.
+"""
+import datetime
+import os
+import re
+import uuid
+import zipfile
+from collections import Counter
+from dataclasses import dataclass, field
+from html import escape
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+from build_cache import DiskCache, hash_file, hash_text
+from convert_markdown import get_pandoc_version
+from pandoc_runner import PandocError, PandocJob, PandocRunner
+
+THIS_DIRECTORY: Path = Path(__file__).parent
+PANDOC_DIRECTORY: Path = THIS_DIRECTORY / "pandoc"
+CHAPTER_TEMPLATE_PATH: Path = PANDOC_DIRECTORY / "epub_chapter.xhtml"
+SYNTAX_DEFINITION_PATH: Path = PANDOC_DIRECTORY / "gdscript.xml"
+HIGHLIGHT_STYLE_PATH: Path = PANDOC_DIRECTORY / "gdscript.theme"
+STYLESHEET_PATH: Path = PANDOC_DIRECTORY / "epub.css"
+
+# All files except the mimetype live in this directory of the archive.
+CONTENT_DIRECTORY: str = "EPUB"
+MIMETYPE: bytes = b"application/epub+zip"
+CONTAINER_XML: str = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="{}/package.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+""".format(
+    CONTENT_DIRECTORY
+)
+MEDIA_TYPES: Dict[str, str] = {
+    ".css": "text/css",
+    ".gif": "image/gif",
+    ".jpeg": "image/jpeg",
+    ".jpg": "image/jpeg",
+    ".mp4": "video/mp4",
+    ".png": "image/png",
+    ".svg": "image/svg+xml",
+    ".webp": "image/webp",
+    ".xhtml": "application/xhtml+xml",
+}
+# Reading systems don't have to play videos, so the package points video items
+# to a document to show instead.
+FALLBACK_MEDIA_TYPES: List[str] = ["video/mp4"]
+FALLBACK_DOCUMENT_NAME: str = "video_fallback.xhtml"
+FALLBACK_DOCUMENT_ID: str = "video-fallback"
+# Increment when the chapters' XHTML changes, to render cached chapters again.
+CHAPTER_CACHE_VERSION: str = "2"
+# HTML elements that can't have content, which XHTML writes as `<br />`.
+VOID_ELEMENTS: Set[str] = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "param",
+    "source",
+    "track",
+    "wbr",
+}
+# HTML elements whose content isn't parsed.
+RAW_TEXT_ELEMENTS: Set[str] = {"script", "style"}
+RE_XML_NAME: re.Pattern = re.compile(r"^[A-Za-z_:][\w.:-]*$")
+# Entries get a fixed timestamp so the same inputs give the same archive.
+ZIP_DATE_TIME: Tuple[int, ...] = (1980, 1, 1, 0, 0, 0)
+# Headings shown in the table of contents.
+MAX_NAV_LEVEL: int = 2
+
+RE_HEADING: re.Pattern = re.compile(
+    r'<h(?P<level>[1-6]) id="(?P<id>[^"]+)"[^>]*>(?P<title>.*?)</h(?P=level)>',
+    flags=re.DOTALL,
+)
+RE_TAG: re.Pattern = re.compile(r"<[^>]+>")
+RE_METADATA: re.Pattern = re.compile(r"^(?P<key>\w+):\s*(?P<value>.*)$")
+
+
+@dataclass
+class BookMetadata:
+    title: str
+    author: str = ""
+    language: str = "en"
+
+    def get_identifier(self) -> str:
+        """Returns an identifier that stays the same across builds."""
+        return "urn:uuid:{}".format(uuid.uuid5(uuid.NAMESPACE_URL, self.title))
+
+
+@dataclass
+class Resource:
+    """A file to store in the book, like a picture."""
+
+    archive_name: str
+    path: Path
+    properties: str = ""
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[Path(self.archive_name).suffix.lower()]
+
+
+@dataclass
+class Heading:
+    level: int
+    id: str
+    title: str
+    children: List["Heading"] = field(default_factory=list)
+
+
+def get_media_type(path: Path) -> Optional[str]:
+    return MEDIA_TYPES.get(path.suffix.lower())
+
+
+def read_metadata(path: Path) -> BookMetadata:
+    """Reads the title, author, and language from pandoc's metadata file.
+
+    Only supports the single-line `key: value` fields the book needs."""
+    values: Dict[str, str] = {}
+    with open(path, "r") as metadata_file:
+        for line in metadata_file:
+            match = RE_METADATA.match(line.strip())
+            if match:
+                values[match.group("key")] = match.group("value").strip("\"'")
+    return BookMetadata(
+        title=values.get("title", ""),
+        author=values.get("author", ""),
+        language=values.get("lang", "en"),
+    )
+
+
+class XhtmlWriter(HTMLParser):
+    """Writes an HTML document again as well-formed XHTML.
+
+    Quotes and escapes attributes, closes void elements and elements left open,
+    drops end tags without a start tag, and replaces named character
+    references, which XML doesn't define, with the characters. Drops
+    comments."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.open_tags: List[str] = []
+
+    def write_start_tag(self, tag: str, attributes: list, is_empty: bool) -> None:
+        names: Set[str] = set()
+        parts: List[str] = ["<" + tag]
+        for name, value in attributes:
+            if name in names or not RE_XML_NAME.match(name):
+                continue
+            names.add(name)
+            # Boolean attributes like `controls` need a value in XML.
+            parts.append(' {}="{}"'.format(name, escape(name if value is None else value)))
+        parts.append(" />" if is_empty else ">")
+        self.parts.append("".join(parts))
+
+    def handle_starttag(self, tag: str, attributes: list) -> None:
+        is_void: bool = tag in VOID_ELEMENTS
+        self.write_start_tag(tag, attributes, is_void)
+        if not is_void:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag: str, attributes: list) -> None:
+        self.write_start_tag(tag, attributes, True)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag not in self.open_tags:
+            return
+        while True:
+            open_tag: str = self.open_tags.pop()
+            self.parts.append("</{}>".format(open_tag))
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data: str) -> None:
+        if self.open_tags and self.open_tags[-1] in RAW_TEXT_ELEMENTS:
+            is_escaped: bool = "<" in data or "&" in data
+            self.parts.append("<![CDATA[{}]]>".format(data) if is_escaped else data)
+        else:
+            self.parts.append(escape(data, quote=False))
+
+    def handle_decl(self, declaration: str) -> None:
+        self.parts.append("<!{}>".format(declaration))
+
+    def handle_pi(self, data: str) -> None:
+        self.parts.append("<?{}>".format(data))
+
+    def unknown_decl(self, data: str) -> None:
+        if data.startswith("CDATA["):
+            self.handle_data(data[len("CDATA[") :])
+
+    def get_xhtml(self) -> str:
+        self.close()
+        return "".join(self.parts + ["</{}>".format(tag) for tag in reversed(self.open_tags)])
+
+
+def to_xhtml(html: str) -> str:
+    """Returns the HTML document `html` as well-formed XHTML."""
+    writer = XhtmlWriter()
+    writer.feed(html)
+    return writer.get_xhtml()
+
+
+def get_chapter_job(path: Path, content: str, language: str) -> PandocJob:
+    """Builds a pandoc job that renders the chapter's markdown `content` to a
+    complete HTML document on its standard output."""
+    command: List[str] = [
+        "pandoc",
+        "--from",
+        "markdown",
+        "--to",
+        "html5",
+        "--standalone",
+        "--template",
+        CHAPTER_TEMPLATE_PATH.as_posix(),
+        "--metadata",
+        "pagetitle=" + path.stem,
+        "--metadata",
+        "lang=" + language,
+        "--syntax-definition",
+        SYNTAX_DEFINITION_PATH.as_posix(),
+        "--highlight-style",
+        HIGHLIGHT_STYLE_PATH.as_posix(),
+    ]
+    return PandocJob(
+        command, cwd=path.parent, input=content.encode("utf-8"), name=str(path)
+    )
+
+
+def get_chapter_cache_key(path: Path, content: str, language: str) -> Tuple[str, ...]:
+    """Returns a key identifying everything that affects a rendered chapter.
+    Pictures aren't part of it, as chapters only link to them."""
+    return (
+        "epub chapter",
+        CHAPTER_CACHE_VERSION,
+        get_pandoc_version(),
+        path.stem,
+        language,
+        hash_text(content),
+        hash_file(CHAPTER_TEMPLATE_PATH),
+        hash_file(SYNTAX_DEFINITION_PATH),
+        hash_file(HIGHLIGHT_STYLE_PATH),
+    )
+
+
+def render_chapter(
+    path: Path,
+    language: str,
+    runner: PandocRunner,
+    cache: Optional[DiskCache] = None,
+) -> bytes:
+    """Renders the markdown chapter at `path` to XHTML, or gets it from the
+    `cache` if it was already rendered."""
+    content: str = path.read_text()
+    key: Tuple[str, ...] = ()
+    if cache is not None:
+        key = get_chapter_cache_key(path, content, language)
+        cached: Optional[bytes] = cache.get(key)
+        if cached is not None:
+            return cached
+
+    result = runner.run(get_chapter_job(path, content, language))
+    if not result.succeeded:
+        raise PandocError(result)
+    xhtml: bytes = to_xhtml(result.stdout.decode("utf-8")).encode("utf-8")
+    if cache is not None:
+        cache.set(key, xhtml)
+    return xhtml
+
+
+def find_headings(xhtml: str) -> List[Heading]:
+    """Returns the tree of headings of a rendered chapter, down to
+    `MAX_NAV_LEVEL`."""
+    headings: List[Heading] = []
+    for match in RE_HEADING.finditer(xhtml):
+        level: int = int(match.group("level"))
+        if level > MAX_NAV_LEVEL:
+            continue
+        # Titles are already escaped by pandoc.
+        title: str = RE_TAG.sub("", match.group("title")).strip()
+        heading = Heading(level, match.group("id"), title)
+        if headings and level > headings[-1].level:
+            headings[-1].children.append(heading)
+        else:
+            headings.append(heading)
+    return headings
+
+
+def make_nav_list(file_name: str, headings: List[Heading], indent: str) -> List[str]:
+    lines: List[str] = [indent + "<ol>"]
+    for heading in headings:
+        href: str = quote(file_name) + ("#" + heading.id if heading.id else "")
+        link: str = '<a href="{}">{}</a>'.format(escape(href), heading.title)
+        if not heading.children:
+            lines.append(indent + "  <li>{}</li>".format(link))
+            continue
+        lines.append(indent + "  <li>{}".format(link))
+        lines += make_nav_list(file_name, heading.children, indent + "    ")
+        lines.append(indent + "  </li>")
+    lines.append(indent + "</ol>")
+    return lines
+
+
+def make_nav_document(
+    metadata: BookMetadata, chapters: List[Tuple[str, List[Heading]]]
+) -> str:
+    """Returns the navigation document listing the headings of all chapters."""
+    lines: List[str] = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        "<!DOCTYPE html>",
+        '<html xmlns="http://www.w3.org/1999/xhtml" '
+        'xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="{}">'.format(
+            escape(metadata.language)
+        ),
+        "<head>",
+        '  <meta charset="utf-8" />',
+        "  <title>{}</title>".format(escape(metadata.title)),
+        "</head>",
+        "<body>",
+        '  <nav epub:type="toc" id="toc">',
+        "    <ol>",
+    ]
+    for file_name, headings in chapters:
+        # Lists chapters without headings by their file name.
+        headings = headings or [Heading(1, "", escape(Path(file_name).stem))]
+        lines += make_nav_list(file_name, headings, "    ")[1:-1]
+    lines += ["    </ol>", "  </nav>", "</body>", "</html>", ""]
+    return "\n".join(lines)
+
+
+def make_fallback_document(metadata: BookMetadata) -> str:
+    """Returns the document reading systems show instead of a video they can't
+    play."""
+    return "\n".join(
+        [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            "<!DOCTYPE html>",
+            '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="{}">'.format(
+                escape(metadata.language)
+            ),
+            "<head>",
+            '  <meta charset="utf-8" />',
+            "  <title>{}</title>".format(escape(metadata.title)),
+            "</head>",
+            "<body>",
+            "  <p>This reading system can't play this video.</p>",
+            "</body>",
+            "</html>",
+            "",
+        ]
+    )
+
+
+def needs_fallback_document(resources: List[Resource]) -> bool:
+    return any(resource.media_type in FALLBACK_MEDIA_TYPES for resource in resources)
+
+
+def get_modified_date() -> str:
+    """Returns the book's modification date, honoring SOURCE_DATE_EPOCH for
+    reproducible builds."""
+    timestamp = int(os.environ.get("SOURCE_DATE_EPOCH", 0)) or None
+    date = (
+        datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        if timestamp
+        else datetime.datetime.now(datetime.timezone.utc)
+    )
+    return date.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def make_package_document(
+    metadata: BookMetadata, chapter_names: List[str], resources: List[Resource]
+) -> str:
+    """Returns the OPF package document listing all the files of the book."""
+    items: List[str] = [
+        '    <item id="nav" href="nav.xhtml" '
+        'media-type="application/xhtml+xml" properties="nav"/>'
+    ]
+    spine: List[str] = []
+    for index, file_name in enumerate(chapter_names):
+        items.append(
+            '    <item id="chapter-{}" href="{}" '
+            'media-type="application/xhtml+xml"/>'.format(
+                index, escape(quote(file_name))
+            )
+        )
+        spine.append('    <itemref idref="chapter-{}"/>'.format(index))
+    if needs_fallback_document(resources):
+        items.append(
+            '    <item id="{}" href="{}" media-type="application/xhtml+xml"/>'.format(
+                FALLBACK_DOCUMENT_ID, FALLBACK_DOCUMENT_NAME
+            )
+        )
+    for index, resource in enumerate(resources):
+        properties: str = (
+            ' properties="{}"'.format(resource.properties) if resource.properties else ""
+        )
+        if resource.media_type in FALLBACK_MEDIA_TYPES:
+            properties += ' fallback="{}"'.format(FALLBACK_DOCUMENT_ID)
+        items.append(
+            '    <item id="resource-{}" href="{}" media-type="{}"{}/>'.format(
+                index,
+                escape(quote(resource.archive_name)),
+                resource.media_type,
+                properties,
+            )
+        )
+
+    author: List[str] = (
+        ["    <dc:creator>{}</dc:creator>".format(escape(metadata.author))]
+        if metadata.author
+        else []
+    )
+    return "\n".join(
+        [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" '
+            'unique-identifier="book-id" xml:lang="{}">'.format(
+                escape(metadata.language)
+            ),
+            '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">',
+            '    <dc:identifier id="book-id">{}</dc:identifier>'.format(
+                metadata.get_identifier()
+            ),
+            "    <dc:title>{}</dc:title>".format(escape(metadata.title)),
+        ]
+        + author
+        + [
+            "    <dc:language>{}</dc:language>".format(escape(metadata.language)),
+            '    <meta property="dcterms:modified">{}</meta>'.format(
+                get_modified_date()
+            ),
+            "  </metadata>",
+            "  <manifest>",
+        ]
+        + items
+        + ["  </manifest>", "  <spine>"]
+        + spine
+        + ["  </spine>", "</package>", ""]
+    )
+
+
+def write_entry(archive: zipfile.ZipFile, name: str, data: bytes, method: int) -> None:
+    info = zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME)
+    info.compress_type = method
+    info.external_attr = 0o644 << 16
+    archive.writestr(info, data)
+
+
+def write_epub(
+    output_path: Path,
+    metadata: BookMetadata,
+    chapter_paths: List[Path],
+    resources: List[Resource],
+) -> None:
+    """Writes the book to `output_path` from rendered XHTML chapters and
+    resources, in order.
+
+    Raises a `ValueError` if two files would have the same path in the book."""
+    chapters: List[Tuple[str, bytes]] = [
+        (path.name, path.read_bytes()) for path in chapter_paths
+    ]
+    fallback_documents: List[Tuple[str, str]] = []
+    if needs_fallback_document(resources):
+        fallback_documents.append(
+            (FALLBACK_DOCUMENT_NAME, make_fallback_document(metadata))
+        )
+    archive_names = Counter(
+        ["package.opf", "nav.xhtml"]
+        + [file_name for file_name, _ in fallback_documents]
+        + [file_name for file_name, _ in chapters]
+        + [resource.archive_name for resource in resources]
+    )
+    duplicate_names: List[str] = sorted(
+        name for name, count in archive_names.items() if count > 1
+    )
+    if duplicate_names:
+        raise ValueError(
+            "Several files would have the same path in the Epub: "
+            + ", ".join(duplicate_names)
+        )
+    nav_document: str = make_nav_document(
+        metadata,
+        [
+            (file_name, find_headings(xhtml.decode("utf-8")))
+            for file_name, xhtml in chapters
+        ],
+    )
+    package_document: str = make_package_document(
+        metadata, [file_name for file_name, _ in chapters], resources
+    )
+    documents: List[Tuple[str, str]] = [
+        ("package.opf", package_document),
+        ("nav.xhtml", nav_document),
+    ] + fallback_documents
+
+    with zipfile.ZipFile(output_path, "w") as archive:
+        # Reading systems expect the uncompressed mimetype as the first entry.
+        write_entry(archive, "mimetype", MIMETYPE, zipfile.ZIP_STORED)
+        write_entry(
+            archive,
+            "META-INF/container.xml",
+            CONTAINER_XML.encode("utf-8"),
+            zipfile.ZIP_DEFLATED,
+        )
+        for name, text in documents:
+            write_entry(
+                archive,
+                CONTENT_DIRECTORY + "/" + name,
+                text.encode("utf-8"),
+                zipfile.ZIP_DEFLATED,
+            )
+        for file_name, xhtml in chapters:
+            write_entry(
+                archive,
+                CONTENT_DIRECTORY + "/" + file_name,
+                xhtml,
+                zipfile.ZIP_DEFLATED,
+            )
+        for resource in resources:
+            # Pictures and videos are already compressed.
+            method: int = (
+                zipfile.ZIP_DEFLATED
+                if resource.media_type in ("text/css", "image/svg+xml")
+                else zipfile.ZIP_STORED
+            )
+            write_entry(
+                archive,
+                CONTENT_DIRECTORY + "/" + resource.archive_name,
+                resource.path.read_bytes(),
+                method,
+            )
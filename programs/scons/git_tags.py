@@ -0,0 +1,204 @@
+"""Finds the release tag of git repositories, reading git's files directly
+when possible.
+
+`describe_tags()` returns the same result as `git describe --tags`. When HEAD
+is exactly at a single tag, it reads HEAD, the refs, and the packed-refs
+file instead of starting a git process. In other cases, like when HEAD is a
+few commits after a tag, it falls back to running git.
+"""
+import os
+import subprocess
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Limit to the number of symbolic refs to follow, like git's.
+MAX_SYMBOLIC_REF_DEPTH: int = 5
+PACKED_REFS_HEADER: str = "# pack-refs with:"
+
+
+class GitDescribeError(Exception):
+    pass
+
+
+def find_git_directory(directory: Path) -> Optional[Tuple[Path, Path]]:
+    """Returns the git directory of the repository containing `directory` and
+    its common directory, where refs are stored. Returns `None` if `directory`
+    isn't in a repository.
+
+    Supports submodules and worktrees, whose .git is a file pointing to the
+    actual git directory."""
+    for parent in [Path(directory).resolve()] + list(Path(directory).resolve().parents):
+        dot_git: Path = parent / ".git"
+        if dot_git.exists():
+            break
+    else:
+        return None
+
+    if dot_git.is_dir():
+        git_directory: Path = dot_git
+    else:
+        content: str = dot_git.read_text().strip()
+        if not content.startswith("gitdir:"):
+            return None
+        git_directory = (dot_git.parent / content[len("gitdir:") :].strip()).resolve()
+
+    common_directory: Path = git_directory
+    commondir_file: Path = git_directory / "commondir"
+    if commondir_file.is_file():
+        common_directory = (git_directory / commondir_file.read_text().strip()).resolve()
+    return git_directory, common_directory
+
+
+def read_packed_refs(common_directory: Path) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Returns the refs in the packed-refs file, and the commits the tags
+    point to.
+
+    Tags are only missing from the second dictionary if the file doesn't say
+    which tags are annotated, in which case they need to be peeled."""
+    refs: Dict[str, str] = {}
+    peeled: Dict[str, str] = {}
+    try:
+        lines: List[str] = (common_directory / "packed-refs").read_text().splitlines()
+    except OSError:
+        return refs, peeled
+
+    # Git writes a `^` line after every annotated tag if the header lists the
+    # `peeled` or `fully-peeled` trait.
+    are_tags_peeled: bool = False
+    ref_name: str = ""
+    for line in lines:
+        if line.startswith(PACKED_REFS_HEADER):
+            traits: List[str] = line[len(PACKED_REFS_HEADER) :].split()
+            are_tags_peeled = "peeled" in traits or "fully-peeled" in traits
+            continue
+        if line.startswith("#") or not line:
+            continue
+        if line.startswith("^"):
+            peeled[ref_name] = line[1:]
+            continue
+        sha, ref_name = line.split(" ", 1)
+        refs[ref_name] = sha
+    if are_tags_peeled:
+        for name, sha in refs.items():
+            if name.startswith("refs/tags/"):
+                peeled.setdefault(name, sha)
+    return refs, peeled
+
+
+def read_loose_tags(common_directory: Path) -> Dict[str, str]:
+    tags: Dict[str, str] = {}
+    tags_directory: Path = common_directory / "refs" / "tags"
+    for root, _, filenames in os.walk(tags_directory):
+        for filename in filenames:
+            path: Path = Path(root, filename)
+            ref_name: str = "refs/" + path.relative_to(common_directory / "refs").as_posix()
+            tags[ref_name] = path.read_text().strip()
+    return tags
+
+
+def resolve_ref(
+    git_directory: Path, common_directory: Path, packed_refs: Dict[str, str], ref: str
+) -> Optional[str]:
+    """Returns the object name `ref` points to, following symbolic refs."""
+    for _ in range(MAX_SYMBOLIC_REF_DEPTH):
+        if not ref.startswith("refs/") and ref != "HEAD":
+            return ref
+        value: Optional[str] = None
+        for directory in (git_directory, common_directory):
+            try:
+                value = (directory / ref).read_text().strip()
+                break
+            except OSError:
+                continue
+        if value is None:
+            value = packed_refs.get(ref)
+        if value is None:
+            return None
+        if not value.startswith("ref:"):
+            return value
+        ref = value[len("ref:") :].strip()
+    return None
+
+
+def peel_loose_tag(common_directory: Path, sha: str) -> Optional[str]:
+    """Returns the commit an object points to, or `None` if the object isn't
+    stored as a loose object, or isn't a tag of a commit or a commit."""
+    object_path: Path = common_directory / "objects" / sha[:2] / sha[2:]
+    try:
+        data: bytes = zlib.decompress(object_path.read_bytes())
+    except (OSError, zlib.error):
+        return None
+    header, _, body = data.partition(b"\0")
+    object_type: bytes = header.split(b" ")[0]
+    if object_type == b"commit":
+        return sha
+    if object_type != b"tag":
+        return None
+    fields: Dict[bytes, bytes] = {}
+    for line in body.split(b"\n"):
+        if not line:
+            break
+        key, _, value = line.partition(b" ")
+        fields[key] = value
+    if fields.get(b"type") != b"commit":
+        return None
+    return fields[b"object"].decode("ascii")
+
+
+def find_exact_tag(directory: Path) -> Optional[str]:
+    """Returns the name of the tag HEAD points to by reading git's files, or
+    `None` if HEAD isn't at exactly one tag or we can't tell."""
+    directories = find_git_directory(directory)
+    if directories is None:
+        return None
+    git_directory, common_directory = directories
+    packed_refs, peeled_refs = read_packed_refs(common_directory)
+    head: Optional[str] = resolve_ref(git_directory, common_directory, packed_refs, "HEAD")
+    if head is None:
+        return None
+
+    tags: Dict[str, str] = {
+        name: sha for name, sha in packed_refs.items() if name.startswith("refs/tags/")
+    }
+    loose_tags: Dict[str, str] = read_loose_tags(common_directory)
+    tags.update(loose_tags)
+
+    matching_tags: List[str] = []
+    for name, sha in tags.items():
+        commit: Optional[str] = sha
+        if sha != head:
+            commit = None if name in loose_tags else peeled_refs.get(name)
+            if commit is None:
+                commit = peel_loose_tag(common_directory, sha)
+                # The tag object may be in a pack file, which we don't read.
+                if commit is None:
+                    return None
+        if commit == head:
+            matching_tags.append(name[len("refs/tags/") :])
+    # When several tags point to HEAD, git picks one based on their type and
+    # date, so we let git decide.
+    return matching_tags[0] if len(matching_tags) == 1 else None
+
+
+def run_git_describe(directory: Path) -> str:
+    out = subprocess.run(
+        ["git", "describe", "--tags"], capture_output=True, cwd=directory
+    )
+    if out.returncode != 0:
+        raise GitDescribeError(f"{directory}: {out.stderr.decode().strip()}")
+    return out.stdout.decode().strip()
+
+
+def describe_tags(directory: Path) -> str:
+    """Returns the output of `git describe --tags` in `directory`."""
+    return find_exact_tag(directory) or run_git_describe(directory)
+
+
+def describe_all(directories: List[Path], max_workers: int = 0) -> Dict[Path, str]:
+    """Runs `describe_tags()` on all `directories` in parallel.
+
+    Raises `GitDescribeError` if any of them fails."""
+    with ThreadPoolExecutor(max_workers=max_workers or min(32, len(directories) or 1)) as executor:
+        return dict(zip(directories, executor.map(describe_tags, directories)))
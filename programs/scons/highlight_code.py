@@ -1,56 +1,283 @@
+"""Finds code blocks in markdown documents and runs their content through a code highlighter.
 
-"""Finds code blocks in markdown documents and runs their content through the code highlighting
-program Chroma. Requires `chroma` to be installed and available on the PATH variable."""
+Two highlighters are available:
+
+- Chroma, the default. Requires `chroma` to be installed and available on the PATH variable.
+- Pygments, which runs in-process and highlights a whole document without starting any program.
+  Requires the `pygments` Python package."""
 
 import subprocess
 import argparse
-import re
+import functools
+import shutil
 import sys
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from os.path import basename, join
+from typing import Dict, List, Optional, Tuple
+
+from build_cache import (
+    DEFAULT_MAX_SIZE,
+    DiskCache,
+    get_default_cache_directory,
+    hash_text,
+)
+from document import Block, BlockTypes, Document
+
+try:
+    import pygments
+    import pygments.formatters
+    import pygments.lexers
+    import pygments.util
+except ImportError:
+    pygments = None
 
 
 ERROR_CHROMA_NOT_FOUND = "Program chroma not found. You need chroma to be installed and available on PATH to use this program."
+ERROR_PYGMENTS_NOT_FOUND = "Python package pygments not found. Install it with pip to use the pygments highlighter."
 
+DEFAULT_LANGUAGE = "gdscript"
+STYLE = "monokai"
 COMMAND_HIGHLIGHT = [
     "chroma",
     "--html",
     "--html-only",
     "--html-inline-styles",
-    "--style=monokai",
+    "--style=" + STYLE,
 ]
+CHROMA_BLOCK_END = "</pre>"
+
+
+@dataclass
+class CodeBlock:
+    language: str
+    code: str
+
+
+class ChromaHighlighter:
+    """Highlights code blocks by running chroma.
+
+    Chroma highlights several files in one call, with one lexer. We write each
+    block of a batch to a temporary file and run chroma once per language. The
+    calls run on a pool of threads shared by all documents, which bounds the
+    number of chroma processes when a build system highlights several
+    documents in parallel."""
 
+    name = "chroma"
 
-def highlight_code_blocks(content: str) -> str:
-    def highlight_with_chroma(match):
-        language = match.group(1)
-        if language == "":
-            language = "gdscript"
+    def __init__(self, max_workers: int = 0) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count())
+        self._version: str = ""
 
-        command = COMMAND_HIGHLIGHT + ["--lexer=" + language]
+    def get_version(self) -> str:
+        if self._version == "":
+            result = subprocess.run(
+                ["chroma", "--version"], stdout=subprocess.PIPE, text=True,
+            )
+            self._version = result.stdout.strip()
+        return self._version
+
+    def highlight(self, block: CodeBlock) -> Optional[str]:
+        command = COMMAND_HIGHLIGHT + ["--lexer=" + block.language]
         result = subprocess.run(
-            command, input=match.group(2), stdout=subprocess.PIPE, text=True,
+            command, input=block.code, stdout=subprocess.PIPE, text=True,
         )
-        return result.stdout if result.returncode == 0 else match.string
+        return result.stdout if result.returncode == 0 else None
 
-    return re.sub(
-        "```([a-z]*)\n(.*?)```", highlight_with_chroma, content, flags=re.S
-    )
+    def highlight_language(self, language: str, codes: List[str]) -> List[Optional[str]]:
+        """Highlights all the `codes` written in `language` with one chroma
+        process."""
+        with tempfile.TemporaryDirectory() as directory:
+            paths: List[str] = []
+            for index, code in enumerate(codes):
+                path: str = join(directory, str(index))
+                with open(path, "w") as code_file:
+                    code_file.write(code)
+                paths.append(path)
+            command = COMMAND_HIGHLIGHT + ["--lexer=" + language] + paths
+            result = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            return [None] * len(codes)
+        # Chroma escapes the code, so the only closing tags are the ones that
+        # end each file's block.
+        outputs: List[str] = [
+            part.lstrip("\n") + CHROMA_BLOCK_END
+            for part in result.stdout.split(CHROMA_BLOCK_END)[:-1]
+        ]
+        if len(outputs) != len(codes):
+            return [self.highlight(CodeBlock(language, code)) for code in codes]
+        return outputs
 
+    def highlight_blocks(self, blocks: List[CodeBlock]) -> List[Optional[str]]:
+        """Returns the HTML for each block, or `None` if highlighting failed."""
+        languages: Dict[str, List[int]] = {}
+        for index, block in enumerate(blocks):
+            languages.setdefault(block.language, []).append(index)
+        outputs: List[Optional[str]] = [None] * len(blocks)
+        highlighted_languages = self._executor.map(
+            lambda language: self.highlight_language(
+                language, [blocks[index].code for index in languages[language]]
+            ),
+            languages,
+        )
+        for indices, highlighted in zip(languages.values(), highlighted_languages):
+            for index, output in zip(indices, highlighted):
+                outputs[index] = output
+        return outputs
 
-def highlight_file(file_path: str) -> str:
-    """Finds code blocks in the markdown document"""
-    with open(file_path, "r") as md_file:
-        return highlight_code_blocks(md_file.read())
+
+class PygmentsHighlighter:
+    """Highlights code blocks in-process with pygments."""
+
+    name = "pygments"
+
+    def __init__(self) -> None:
+        self._formatter = pygments.formatters.HtmlFormatter(style=STYLE, noclasses=True)
+
+    def get_version(self) -> str:
+        return pygments.__version__
+
+    def highlight(self, block: CodeBlock) -> Optional[str]:
+        try:
+            lexer = pygments.lexers.get_lexer_by_name(block.language)
+        except pygments.util.ClassNotFound:
+            return None
+        return pygments.highlight(block.code, lexer, self._formatter)
+
+    def highlight_blocks(self, blocks: List[CodeBlock]) -> List[Optional[str]]:
+        """Returns the HTML for each block, or `None` if highlighting failed."""
+        return [self.highlight(block) for block in blocks]
+
+
+def is_chroma_installed() -> bool:
+    return shutil.which("chroma") is not None
+
+
+def is_pygments_installed() -> bool:
+    return pygments is not None
+
+
+HIGHLIGHTERS = {
+    ChromaHighlighter.name: ChromaHighlighter,
+    PygmentsHighlighter.name: PygmentsHighlighter,
+}
+
+
+def resolve_highlighter_name(name: str = "") -> str:
+    """Returns the name of the highlighter to use. If `name` is empty, that's
+    chroma if it's installed and pygments otherwise."""
+    if name == "":
+        return (
+            ChromaHighlighter.name
+            if is_chroma_installed() or not is_pygments_installed()
+            else PygmentsHighlighter.name
+        )
+    return name
+
+
+def get_missing_dependency_error(name: str) -> str:
+    """Returns an error message if the highlighter `name` can't run, or an
+    empty string."""
+    if name == ChromaHighlighter.name and not is_chroma_installed():
+        return ERROR_CHROMA_NOT_FOUND
+    if name == PygmentsHighlighter.name and not is_pygments_installed():
+        return ERROR_PYGMENTS_NOT_FOUND
+    return ""
 
 
-def is_chroma_installed():
-    return (
-        subprocess.run(["chroma", "--version"], stdout=subprocess.DEVNULL).returncode
-        == 0
+@functools.lru_cache(maxsize=None)
+def _create_highlighter(name: str):
+    return HIGHLIGHTERS[name]()
+
+
+def get_highlighter(name: str = ""):
+    """Returns the highlighter named `name`, creating it on the first call.
+
+    Every caller gets the same instance, so all the documents of a build share
+    one highlighter. If `name` is empty, uses chroma if it's installed and
+    pygments otherwise."""
+    name = resolve_highlighter_name(name)
+    error: str = get_missing_dependency_error(name)
+    if error and name == PygmentsHighlighter.name:
+        raise ImportError(error)
+    if error:
+        raise ProcessLookupError(error)
+    return _create_highlighter(name)
+
+
+def create_cache(directory: str = "", max_size: int = DEFAULT_MAX_SIZE) -> DiskCache:
+    """Returns a cache for highlighted code blocks, stored in `directory` or
+    in the default cache directory."""
+    return DiskCache(
+        directory if directory else get_default_cache_directory() / "highlight",
+        max_size,
     )
 
 
+def process_parsed_document(
+    document: Document, cache: Optional[DiskCache] = None, highlighter=None
+) -> None:
+    """Replaces the code blocks of `document` with highlighted HTML blocks.
+
+    Highlights all the code blocks of the document with a single call to the
+    highlighter. If you pass a `cache`, code blocks that were already
+    highlighted with the same highlighter version, lexer, and style don't get
+    highlighted again."""
+    if highlighter is None:
+        highlighter = get_highlighter()
+
+    code_blocks: List[Block] = document.get_blocks(BlockTypes.code)
+    blocks: List[CodeBlock] = [
+        CodeBlock(block.language or DEFAULT_LANGUAGE, block.text) for block in code_blocks
+    ]
+    keys: List[Tuple[str, ...]] = [
+        (
+            highlighter.name,
+            highlighter.get_version(),
+            block.language,
+            STYLE,
+            hash_text(block.code),
+        )
+        for block in blocks
+    ]
+    outputs: List[Optional[str]] = [
+        cache.get_text(key) if cache is not None else None for key in keys
+    ]
+
+    missing_indices: List[int] = [i for i, output in enumerate(outputs) if output is None]
+    highlighted_blocks = highlighter.highlight_blocks([blocks[i] for i in missing_indices])
+    for index, highlighted in zip(missing_indices, highlighted_blocks):
+        if highlighted is None:
+            continue
+        outputs[index] = highlighted
+        if cache is not None:
+            cache.set_text(keys[index], highlighted)
+
+    for block, output in zip(code_blocks, outputs):
+        if output is not None:
+            block.type = BlockTypes.html
+            block.text = output
+
+
+def highlight_code_blocks(
+    content: str, cache: Optional[DiskCache] = None, highlighter=None
+) -> str:
+    """Replaces code blocks in `content` with highlighted HTML."""
+    document = Document.parse(content)
+    process_parsed_document(document, cache, highlighter)
+    return document.serialize()
+
+
+def highlight_file(
+    file_path: str, cache: Optional[DiskCache] = None, highlighter=None
+) -> str:
+    """Finds code blocks in the markdown document"""
+    with open(file_path, "r") as md_file:
+        return highlight_code_blocks(md_file.read(), cache, highlighter)
+
+
 def get_args(args) -> argparse.Namespace:
     """Parses the command line arguments"""
     parser = argparse.ArgumentParser(description=__doc__,)
@@ -67,17 +294,33 @@ def get_args(args) -> argparse.Namespace:
     parser.add_argument(
         "-i", "--in-place", action="store_true", help="Overwrite the source files."
     )
+    parser.add_argument(
+        "--highlighter",
+        choices=list(HIGHLIGHTERS.keys()),
+        default="",
+        help="Program to highlight code with. Default: chroma if installed, otherwise pygments.",
+    )
+    parser.add_argument(
+        "--cache-directory",
+        type=str,
+        default="",
+        help="Path to the highlighted code cache. Default: a directory in the user's cache.",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Always highlight every code block."
+    )
     return parser.parse_args(args)
 
 
 def main():
-    if not is_chroma_installed():
-        raise ProcessLookupError(ERROR_CHROMA_NOT_FOUND)
-
     args: argparse.Namespace = get_args(sys.argv)
+    highlighter = get_highlighter(args.highlighter)
+    cache: Optional[DiskCache] = None
+    if not args.no_cache:
+        cache = create_cache(args.cache_directory)
     filepaths = [f for f in args.files if f.lower().endswith(".md")]
     for filepath in filepaths:
-        content = highlight_file(filepath)
+        content = highlight_file(filepath, cache, highlighter)
 
         # If no --output option set, output to stdout
         if args.output == "":
@@ -89,6 +332,9 @@ def main():
             with open(out_path, "w") as document:
                 document.write(content)
 
+    if cache is not None:
+        print(cache.format_stats("Highlight"), file=sys.stderr)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,125 @@
+"""Groups the pictures and videos of a course by file name and by content.
+
+The Epub build puts all media files in one directory, so two different files
+can't share a name. Files with the same content only need to be stored once,
+whatever their name, and documents can point to a single copy.
+
+Files of different sizes can't have the same content, so we only hash files
+that share their size with another file.
+"""
+import os
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+from build_cache import hash_file
+from markdown_dependencies import (
+    RE_EXTERNAL_URL,
+    RE_HTML_MEDIA,
+    RE_LINK_REFERENCE_DEFINITION,
+    RE_MARKDOWN_IMAGE,
+)
+
+# Patterns of media references and the groups that contain their path. Link
+# reference definitions cover reference-style images like `![alt][label]`.
+MEDIA_REFERENCE_PATTERNS: List[Tuple[re.Pattern, tuple]] = [
+    (RE_MARKDOWN_IMAGE, (1, 2)),
+    (RE_HTML_MEDIA, (1,)),
+    (RE_LINK_REFERENCE_DEFINITION, ("bracketed_path", "path")),
+]
+
+
+@dataclass
+class ImageIndex:
+    # Files by name, sorted by path.
+    files_by_name: Dict[str, List[Path]] = field(default_factory=dict)
+    # The file to store instead of each file. Among files with the same
+    # content, the first one by path.
+    canonical_files: Dict[Path, Path] = field(default_factory=dict)
+    sizes: Dict[Path, int] = field(default_factory=dict)
+
+    @classmethod
+    def from_files(cls, paths: Iterable[Path]) -> "ImageIndex":
+        index = cls()
+        files_by_size: Dict[int, List[Path]] = defaultdict(list)
+        for path in sorted(paths):
+            index.files_by_name.setdefault(path.name, []).append(path)
+            index.sizes[path] = os.stat(path).st_size
+            files_by_size[index.sizes[path]].append(path)
+
+        for same_size_files in files_by_size.values():
+            files_by_hash: Dict[str, Path] = {}
+            for path in same_size_files:
+                content_hash: str = (
+                    hash_file(path) if len(same_size_files) > 1 else str(path)
+                )
+                index.canonical_files[path] = files_by_hash.setdefault(
+                    content_hash, path
+                )
+        return index
+
+    def get_conflicting_names(self) -> Dict[str, List[Path]]:
+        """Returns the names shared by files with different content."""
+        return {
+            name: paths
+            for name, paths in self.files_by_name.items()
+            if len({self.canonical_files[path] for path in paths}) > 1
+        }
+
+    def get_unique_files(self) -> List[Path]:
+        """Returns one file for each distinct content, in order."""
+        return sorted(set(self.canonical_files.values()))
+
+    def get_renames(self) -> Dict[str, str]:
+        """Maps the names of files stored under another name to that name."""
+        return {
+            path.name: canonical_file.name
+            for path, canonical_file in self.canonical_files.items()
+            if canonical_file.name != path.name
+        }
+
+    def get_saved_size(self) -> int:
+        """Returns the number of bytes saved by storing identical files once."""
+        return sum(
+            self.sizes[path]
+            for path, canonical_file in self.canonical_files.items()
+            if canonical_file != path
+        )
+
+
+def rename_path(path: str, renames: Dict[str, str]) -> str:
+    """Replaces the file name in the relative `path` using `renames`, keeping
+    its directories and any query or fragment. Leaves URLs unchanged."""
+    if RE_EXTERNAL_URL.match(path):
+        return path
+    suffix_start: int = min(
+        [index for index in (path.find("#"), path.find("?")) if index != -1]
+        + [len(path)]
+    )
+    directory, separator, name = path[:suffix_start].rpartition("/")
+    if name not in renames:
+        return path
+    return directory + separator + renames[name] + path[suffix_start:]
+
+
+def rename_references(content: str, renames: Dict[str, str]) -> str:
+    """Rewrites the pictures and videos `content` uses according to
+    `renames`."""
+    if not renames:
+        return content
+
+    def replace(match: re.Match, groups: tuple) -> str:
+        text: str = match.group(0)
+        for group in groups:
+            path: str = match.group(group)
+            if path is None:
+                continue
+            start: int = match.start(group) - match.start(0)
+            return text[:start] + rename_path(path, renames) + text[start + len(path) :]
+        return text
+
+    for regex, groups in MEDIA_REFERENCE_PATTERNS:
+        content = regex.sub(lambda match: replace(match, groups), content)
+    return content
@@ -24,10 +24,19 @@ import re
 import sys
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 from datargs import arg, parse
 
+from anchor_index import (
+    Anchor,
+    AnchorIndex,
+    get_anchor_content,
+    get_index_path,
+    index_anchors,
+    merge_anchors,
+)
+from document import BlockTypes, Document
 from scons_helper import print_error
 
 INCLUDE_LOGGER = logging.getLogger("include")
@@ -35,6 +44,7 @@ INCLUDE_LOGGER = logging.getLogger("include")
 ERROR_PROJECT_DIRECTORY_NOT_FOUND: int = 1
 ERROR_ATTEMPT_TO_FIND_DUPLICATE_FILE: int = 2
 ERROR_ANCHOR_NOT_FOUND: int = 3
+ERROR_MALFORMED_ANCHOR: int = 4
 
 REGEX_INCLUDE: re.Pattern = re.compile(
     r"^{% *include [\"']?(?P<file>.+?\.[a-zA-Z0-9]+)[\"']? *[\"']?(?P<anchor>\w+)?[\"']? *%}$",
@@ -102,14 +112,13 @@ def find_duplicate_files(files: List[Path]) -> Tuple[dict, set]:
     return files_map, duplicate_files
 
 
-def get_file_content(file_path: str, files: dict, duplicate_files: list) -> str:
-    """Returns the content of a file, finding it if `file_path` is only a file name."""
+def find_file_path(file_path: str, files: dict, duplicate_files: list) -> str:
+    """Returns the path to a file, finding it if `file_path` is only a file name."""
 
     def is_filename(file_path: str) -> bool:
         """Returns `True` if the provided path does not contain a slash character."""
         return file_path.find("/") == -1 and file_path.find("\\") == -1
 
-    content: str = ""
     if is_filename(file_path):
         assert (
             file_path not in duplicate_files
@@ -117,42 +126,47 @@ def get_file_content(file_path: str, files: dict, duplicate_files: list) -> str:
         file_path = files[file_path]["path"]
     else:
         assert os.path.exists(file_path), "File not found: {}".format(file_path)
+    return file_path
 
-    with open(file_path, "r") as text_file:
+
+def get_file_content(file_path: str, files: dict, duplicate_files: list) -> str:
+    """Returns the content of a file, finding it if `file_path` is only a file name."""
+    content: str = ""
+    with open(find_file_path(file_path, files, duplicate_files), "r") as text_file:
         content = text_file.read()
     return content
 
 
-def find_all_file_anchors(content: str) -> dict:
-    """Returns a dictionary mapping anchor names to the corresponding lines."""
+def find_all_file_anchors(content: str, file_path: str = "") -> dict:
+    """Returns a dictionary mapping anchor names to the corresponding lines.
 
-    def find_all_anchors_in_file(content: str) -> List[str]:
-        """Finds and returns the list of all anchors inside `content`."""
-        return re.findall(r"# ?ANCHOR: ?(\w+)", content)
+    `file_path` is the path of the file `content` comes from, used in error
+    messages."""
+    lines: List[str] = content.split("\n")
+    anchors, errors = index_anchors(lines)
+    if errors:
+        print_error(f"Malformed anchors found in {file_path}:\n" + "\n".join(errors))
+        sys.exit(ERROR_MALFORMED_ANCHOR)
 
-    anchor_map: dict = {}
-    ANCHOR_REGEX_TEMPLATE = r"^\s*# ?ANCHOR: ?{}\s*\n(.+)\n\s*# ?END: ?{}"
+    return {
+        name: get_anchor_content(lines, Anchor(name, start_line, end_line))
+        for name, (start_line, end_line) in merge_anchors(anchors).items()
+    }
 
-    anchors = find_all_anchors_in_file(content)
 
-    for anchor in anchors:
-        regex_pattern = ANCHOR_REGEX_TEMPLATE.format(anchor, anchor)
-        regex_anchor: re.Pattern = re.compile(
-            regex_pattern, flags=re.DOTALL | re.MULTILINE
-        )
-        match: re.Match = regex_anchor.search(content)
-        if not match:
-            print_error(f'Malformed anchor pattern for anchor "{anchor}". '
-            f'The following anchor regex failed to find a match: {regex_pattern}')
-            sys.exit(ERROR_ATTEMPT_TO_FIND_DUPLICATE_FILE)
-        anchor_content = re.sub(
-            r"^\s*# *(ANCHOR|END): *\w+\s*$", "", match.group(1), flags=re.MULTILINE
-        )
-        anchor_map[anchor] = anchor_content
-    return anchor_map
+def replace_includes(
+    content: str,
+    files: dict,
+    duplicate_files: list,
+    anchor_index: Optional[AnchorIndex] = None,
+) -> str:
+    """Replaces include templates with the content of the included files.
 
+    Reads files through `anchor_index` so each file is only read and parsed
+    once, or not at all if the index is persistent and the file didn't change."""
+    if anchor_index is None:
+        anchor_index = AnchorIndex()
 
-def replace_includes(content: str, files: dict, duplicate_files: list) -> str:
     def replace_include(match: re.Match) -> str:
         output: str = ""
 
@@ -160,25 +174,28 @@ def replace_includes(content: str, files: dict, duplicate_files: list) -> str:
 
         path: str = match.group("file")
         anchor: str = match.group("anchor")
+        indexed_file = anchor_index.get_file(
+            Path(find_file_path(path, files, duplicate_files))
+        )
 
         # If there's no anchor specified, include the entire file.
         if not anchor:
-            output = get_file_content(path, files, duplicate_files)
+            output = indexed_file.content
         else:
-            if "anchors" not in files[path]:
-                content: str = get_file_content(path, files, duplicate_files)
-                files[path]["anchors"] = find_all_file_anchors(content)
-
-            anchors = files[path]["anchors"]
-            if not anchor in anchors:
+            if indexed_file.errors:
+                print_error(
+                    f"Malformed anchors found in {path}:\n"
+                    + "\n".join(indexed_file.errors)
+                )
+                sys.exit(ERROR_MALFORMED_ANCHOR)
+            if not anchor in indexed_file.anchors:
                 print_error(
                     "Error: anchor {} not found in file {}. Aborting operation.".format(
                         anchor, path
                     )
                 )
                 sys.exit(ERROR_ANCHOR_NOT_FOUND)
-            anchor_content: str = files[path]["anchors"][anchor]
-            output = anchor_content
+            output = indexed_file.get_anchor_content(anchor)
         return output
 
     return REGEX_INCLUDE.sub(replace_include, content)
@@ -195,15 +212,16 @@ def find_git_root_directory(file_path: Path) -> Path:
     return path
 
 
-def process_document(
-    content: str,
+def process_parsed_document(
+    document: Document,
     document_path: Path,
     project_files: List[Path] = [],
     files_map: dict = {},
     duplicate_files: set = set(),
-) -> str:
-    output: str = ""
-
+    anchor_index: Optional[AnchorIndex] = None,
+) -> None:
+    """Replaces include templates in the code blocks of `document` and on lines
+    of their own."""
     # We allow external programs like a build system to probe and cache the
     # project files once. This is why we check for the arguments passed, to
     # distinguish this case from a standalone run of the program.
@@ -212,9 +230,29 @@ def process_document(
         project_files = find_godot_project_files(document_path)
     if files_map == {}:
         files_map, duplicate_files = find_duplicate_files(project_files)
+    if anchor_index is None:
+        anchor_index = AnchorIndex()
+
+    for block in document.get_blocks(BlockTypes.code, BlockTypes.template):
+        text: str = replace_includes(block.text, files_map, duplicate_files, anchor_index)
+        if block.type == BlockTypes.template and text != block.text:
+            block.type = BlockTypes.text
+        block.text = text
 
-    output = replace_includes(content, files_map, duplicate_files)
-    return output
+
+def process_document(
+    content: str,
+    document_path: Path,
+    project_files: List[Path] = [],
+    files_map: dict = {},
+    duplicate_files: set = set(),
+    anchor_index: Optional[AnchorIndex] = None,
+) -> str:
+    document = Document.parse(content)
+    process_parsed_document(
+        document, document_path, project_files, files_map, duplicate_files, anchor_index
+    )
+    return document.serialize()
 
 
 def main():
@@ -225,9 +263,13 @@ def main():
             "File {} not found. Aborting operation.".format(args.input_file.as_posix())
         )
 
+    anchor_index = AnchorIndex(
+        get_index_path(find_git_root_directory(args.input_file.absolute()))
+    )
     with open(args.input_file, "r") as input_file:
         content: str = input_file.read()
-        output = process_document(content, args.input_file)
+        output = process_document(content, args.input_file, anchor_index=anchor_index)
+    anchor_index.save()
     print(output)
 
 
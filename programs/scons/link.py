@@ -17,7 +17,8 @@ import sys
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterable, Optional
+from document import BlockTypes, Document
 from scons_helper import print_error
 
 from datargs import arg, parse
@@ -27,6 +28,8 @@ LINK_LOGGER = logging.getLogger("link.py")
 ERROR_PROJECT_DIRECTORY_NOT_FOUND: int = 1
 ERROR_LINK_TO_NONEXISTENT_FILE: int = 2
 
+REGEX_LINK: re.Pattern = re.compile(r"{% *link (\w+) ?([\w\-]+)? *%}")
+
 
 @dataclass
 class Args:
@@ -56,12 +59,49 @@ def find_content_files(project_directory: str) -> dict:
     return files
 
 
-def replace_links(content: str, files: List[Path]):
+class LinkIndex:
+    """Maps the name of markdown files to their path relative to the content
+    directory.
+
+    Build it once and pass it to `process_document()` to avoid walking the
+    content directory for every document."""
+
+    def __init__(self, files: dict) -> None:
+        self.files: dict = files
+
+    @classmethod
+    def from_project_directory(cls, project_directory: str) -> "LinkIndex":
+        return cls(find_content_files(project_directory))
+
+    @classmethod
+    def from_files(cls, content_directory: str, file_paths: Iterable) -> "LinkIndex":
+        """Creates the index from a list of already known markdown files."""
+        files: dict = {}
+        for file_path in file_paths:
+            name: str = os.path.splitext(os.path.basename(str(file_path)))[0]
+            files[name] = {
+                "path": os.path.relpath(str(file_path), str(content_directory))
+            }
+        return cls(files)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.files
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def get_path(self, name: str) -> Optional[str]:
+        """Returns the path of the document named `name` relative to the content
+        directory."""
+        entry: Optional[dict] = self.files.get(name)
+        return entry["path"] if entry else None
+
+
+def replace_links(content: str, files: LinkIndex):
     """Pandoc filter to process link patterns with the form
     `{% link FileName %}`"""
 
     LINK_TEMPLATE: str = "[{}](../{})"
-    REGEX_LINK: re.Pattern = re.compile(r"{% *link (\w+) ?([\w\-]+)? *%}")
 
     def replace_link(match: re.Match) -> str:
         filename: str = match.group(1)
@@ -93,22 +133,40 @@ def find_git_root_directory(file_path: Path) -> Path:
     return path
 
 
-def process_document(content: str, file_path: Path) -> str:
-    output: str = ""
-    project_directory: Path = find_git_root_directory(file_path)
-    if not project_directory:
-        print_error("Error: no documents to link to found. Aborting.")
-        sys.exit(ERROR_PROJECT_DIRECTORY_NOT_FOUND)
+def process_parsed_document(
+    document: Document, file_path: Path, link_index: Optional[LinkIndex] = None
+) -> None:
+    """Replaces link templates in `document`, including in code blocks.
+
+    A build system can pass a `link_index` built once for all documents.
+    Otherwise, this function indexes the project's content directory."""
+    if link_index is None:
+        project_directory: Path = find_git_root_directory(file_path)
+        if not project_directory:
+            print_error("Error: no documents to link to found. Aborting.")
+            sys.exit(ERROR_PROJECT_DIRECTORY_NOT_FOUND)
+        link_index = LinkIndex.from_project_directory(project_directory)
 
-    files = find_content_files(project_directory)
-    if not files:
+    if not link_index:
         LINK_LOGGER.warning(
             "Warning: no project documents found, links will need to use complete paths to the target."
         )
 
-    output = replace_links(content, files)
-
-    return output
+    for block in document.get_blocks(
+        BlockTypes.text, BlockTypes.heading, BlockTypes.template, BlockTypes.code
+    ):
+        text: str = replace_links(block.text, link_index)
+        if block.type == BlockTypes.template and text != block.text:
+            block.type = BlockTypes.text
+        block.text = text
+
+
+def process_document(
+    content: str, file_path: Path, link_index: Optional[LinkIndex] = None
+) -> str:
+    document = Document.parse(content)
+    process_parsed_document(document, file_path, link_index)
+    return document.serialize()
 
 
 def main():
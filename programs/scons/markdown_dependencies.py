@@ -0,0 +1,73 @@
+"""Finds the files a markdown document depends on: pictures and videos, included
+code files, and linked documents.
+
+The build system uses these functions to rebuild a document only when one of
+the files it uses changes."""
+import re
+from typing import List
+
+from include import REGEX_INCLUDE
+from link import REGEX_LINK
+
+RE_MARKDOWN_IMAGE: re.Pattern = re.compile(r"!\[[^\]]*\]\(\s*(?:<([^>]+)>|([^)\s]+))")
+RE_HTML_MEDIA: re.Pattern = re.compile(r"\b(?:src|poster)=[\"']([^\"']+)[\"']")
+RE_EXTERNAL_URL: re.Pattern = re.compile(r"^([a-zA-Z][a-zA-Z0-9+.-]*:|//|#)")
+# Matches reference-style images: `![alt][label]`, `![alt][]`, and `![alt]`.
+RE_REFERENCE_IMAGE: re.Pattern = re.compile(r"!\[([^\]]*)\](?![(:])(?:\[([^\]]*)\])?")
+# Matches link reference definitions like `[label]: path/to/file.png "Title"`.
+RE_LINK_REFERENCE_DEFINITION: re.Pattern = re.compile(
+    r"^ {0,3}\[(?P<label>[^\]]+)\]:[ \t]*(?:<(?P<bracketed_path>[^>]+)>|(?P<path>\S+))",
+    re.MULTILINE,
+)
+
+
+def normalize_reference_label(label: str) -> str:
+    """Returns `label` the way markdown compares reference labels: case
+    insensitive and with whitespace collapsed."""
+    return " ".join(label.split()).lower()
+
+
+def find_reference_image_paths(content: str) -> List[str]:
+    """Returns the paths of the reference-style images in `content`, as written
+    in their link reference definitions."""
+    definitions: dict = {}
+    for match in RE_LINK_REFERENCE_DEFINITION.finditer(content):
+        label: str = normalize_reference_label(match.group("label"))
+        # The first definition of a label wins.
+        definitions.setdefault(
+            label, match.group("bracketed_path") or match.group("path")
+        )
+    paths: List[str] = []
+    for match in RE_REFERENCE_IMAGE.finditer(content):
+        label = normalize_reference_label(match.group(2) or match.group(1))
+        if label in definitions:
+            paths.append(definitions[label])
+    return paths
+
+
+def find_media_references(content: str) -> List[str]:
+    """Returns the relative paths of pictures and videos used in `content`,
+    without duplicates."""
+    references: List[str] = [
+        next(group for group in match.groups() if group is not None)
+        for regex in (RE_MARKDOWN_IMAGE, RE_HTML_MEDIA)
+        for match in regex.finditer(content)
+    ]
+    references += find_reference_image_paths(content)
+    paths: dict = {}
+    for path in references:
+        path = path.split("#")[0].split("?")[0]
+        if path and not RE_EXTERNAL_URL.match(path):
+            paths[path] = None
+    return list(paths)
+
+
+def find_included_files(content: str) -> List[str]:
+    """Returns the file names or paths of include templates in `content`."""
+    return list({match.group("file"): None for match in REGEX_INCLUDE.finditer(content)})
+
+
+def find_linked_documents(content: str) -> List[str]:
+    """Returns the names of the documents linked with link templates in
+    `content`."""
+    return list({match.group(1): None for match in REGEX_LINK.finditer(content)})
@@ -1,13 +1,40 @@
 #!/usr/bin/env python3
-"""Copies, cleans up, and zips a single Godot project."""
+"""Cleans up and zips a single Godot project.
+
+Files go straight from the project directory to the zip file, without copying
+the project first. The program compresses files in chunks on all CPU cores,
+and stores already compressed files like pictures and audio as-is.
+
+All entries get the same timestamp and normalized permissions, and are sorted
+by path, so packaging the same project twice produces identical zip files.
+
+With --manifest, the program saves the size, modification time, and hash of
+each file next to the archive. On the next run, it copies the compressed data
+of unchanged files from the previous archive instead of compressing them
+again.
+
+The program writes zip files itself instead of using the zipfile module:
+zipfile compresses each file as it writes it, on a single thread, and can't
+write data that was compressed in parallel or copied from another archive."""
 
 import logging
 import sys
 import os
 import argparse
-import tempfile
+import hashlib
+import json
 import shutil
+import stat
+import struct
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Deque, Dict, Iterator, List, Optional, Tuple
 
+from build_cache import open_file_atomically
 from scons_helper import print_error
 
 LOGGER = logging.getLogger("package_godot_project.py")
@@ -16,6 +43,472 @@ ERROR_GODOT_DIRECTORY_NOT_FOUND: int = 1
 ERROR_GODOT_DIRECTORY_INVALID: int = 2
 ERROR_OUTPUT_DIRECTORY_INVALID: int = 3
 
+# Files and directories to leave out of the archive, at any depth.
+IGNORE_PATTERNS = shutil.ignore_patterns(".import", ".git")
+# File formats that are already compressed. Deflating them again takes time
+# and barely reduces their size.
+STORED_EXTENSIONS: set = {
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".webp",
+    ".ogg",
+    ".oggstr",
+    ".mp3",
+    ".webm",
+    ".ogv",
+    ".mp4",
+    ".zip",
+    ".gz",
+    ".woff",
+    ".woff2",
+}
+# Files are compressed in chunks of this size in parallel. Each chunk is an
+# independent deflate block sequence, like pigz does.
+CHUNK_SIZE: int = 1024 * 1024
+COMPRESSION_LEVEL: int = 6
+
+ZIP_STORED: int = 0
+ZIP_DEFLATED: int = 8
+ZIP64_LIMIT: int = 0xFFFFFFFF
+ZIP_FILE_COUNT_LIMIT: int = 0xFFFF
+# Timestamp of all entries in MS-DOS format: 1980-01-01 00:00:00, the
+# earliest date zip files support.
+DOS_TIME: int = 0
+DOS_DATE: int = (1 << 5) | 1
+VERSION_MADE_BY: int = (3 << 8) | 45
+FLAG_UTF8: int = 0x800
+# Compressed data from a previous archive can only be reused if it was
+# compressed the same way.
+MANIFEST_VERSION: int = 1
+COMPRESSION_SETTINGS: dict = {
+    "chunk_size": CHUNK_SIZE,
+    "level": COMPRESSION_LEVEL,
+    "zlib": zlib.ZLIB_VERSION,
+}
+
+
+@dataclass
+class ZipEntry:
+    name: str
+    external_attributes: int
+    method: int = ZIP_STORED
+    is_zip64: bool = False
+    crc: int = 0
+    compressed_size: int = 0
+    size: int = 0
+    offset: int = 0
+    mtime_ns: int = 0
+    sha256: str = ""
+
+    @property
+    def encoded_name(self) -> bytes:
+        return self.name.encode("utf-8")
+
+    @property
+    def flags(self) -> int:
+        return FLAG_UTF8 if not self.name.isascii() else 0
+
+    @property
+    def version_needed(self) -> int:
+        return 45 if self.is_zip64 else 20
+
+
+def find_files(directory: str) -> Tuple[List[str], List[str]]:
+    """Returns the sorted relative paths of the directories and files to
+    archive in `directory`.
+
+    Leaves out links to directories, which could point outside the project or
+    to one of its parent directories."""
+    directories: List[str] = []
+    files: List[str] = []
+    for root, dirnames, filenames in os.walk(directory):
+        ignored: set = IGNORE_PATTERNS(root, dirnames + filenames)
+        for name in dirnames:
+            if os.path.islink(os.path.join(root, name)):
+                LOGGER.warning(
+                    "Skipping link to a directory %s", os.path.join(root, name)
+                )
+                ignored.add(name)
+        dirnames[:] = sorted(d for d in dirnames if d not in ignored)
+        relative_root: str = os.path.relpath(root, directory)
+        for name in dirnames:
+            directories.append(os.path.normpath(os.path.join(relative_root, name)))
+        for name in sorted(filenames):
+            if name not in ignored:
+                files.append(os.path.normpath(os.path.join(relative_root, name)))
+    return directories, files
+
+
+def compress_chunk(data: bytes, method: int, is_last: bool) -> bytes:
+    """Deflates `data` so that chunks compressed separately concatenate into a
+    valid deflate stream."""
+    if method == ZIP_STORED:
+        return data
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+    flush_mode: int = zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH
+    return compressor.compress(data) + compressor.flush(flush_mode)
+
+
+def flag_last_chunk(chunks: Iterator[bytes]) -> Iterator[Tuple[bytes, bool]]:
+    """Yields each chunk and whether it's the last one. Yields a single empty
+    chunk if there are no chunks."""
+    chunk: bytes = next(chunks, b"")
+    for next_chunk in chunks:
+        yield chunk, False
+        chunk = next_chunk
+    yield chunk, True
+
+
+def read_chunks(path: str) -> Iterator[bytes]:
+    """Yields the content of the file at `path` in chunks."""
+    with open(path, "rb") as input_file:
+        yield from iter(lambda: input_file.read(CHUNK_SIZE), b"")
+
+
+def hash_file(path: str) -> str:
+    file_hash = hashlib.sha256()
+    for chunk in read_chunks(path):
+        file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+class PreviousArchive:
+    """Previous version of an archive and the manifest of its files, to copy
+    the compressed data of unchanged files from."""
+
+    def __init__(self, archive_path: str, manifest_path: str) -> None:
+        self.archive_path: str = archive_path
+        self.manifest_path: str = manifest_path
+        self.files: Dict[str, dict] = {}
+        self.zip_infos: Dict[str, zipfile.ZipInfo] = {}
+        try:
+            with open(manifest_path, "r") as manifest_file:
+                manifest: dict = json.load(manifest_file)
+            with zipfile.ZipFile(archive_path) as archive:
+                self.zip_infos = {info.filename: info for info in archive.infolist()}
+        except (OSError, ValueError, zipfile.BadZipFile):
+            return
+        if (
+            manifest.get("version") == MANIFEST_VERSION
+            and manifest.get("compression") == COMPRESSION_SETTINGS
+        ):
+            self.files = manifest["files"]
+
+    def find_reusable_entry(self, entry: ZipEntry, path: str) -> Optional[dict]:
+        """Returns the manifest entry of `entry` if the file at `path` didn't
+        change since the previous archive, and fills `entry`'s hash.
+
+        Files with the same size and modification time aren't hashed."""
+        previous: Optional[dict] = self.files.get(entry.name)
+        info: Optional[zipfile.ZipInfo] = self.zip_infos.get(entry.name)
+        if (
+            previous is None
+            or info is None
+            or previous["size"] != entry.size
+            or previous["method"] != entry.method
+            or previous["crc"] != info.CRC
+            or info.compress_type != entry.method
+        ):
+            return None
+        if previous["mtime_ns"] != entry.mtime_ns:
+            entry.sha256 = hash_file(path)
+            if entry.sha256 != previous["sha256"]:
+                return None
+        entry.sha256 = previous["sha256"]
+        return previous
+
+    def read_compressed_chunks(self, name: str) -> Iterator[bytes]:
+        """Yields the compressed data of the entry `name` in chunks."""
+        info: zipfile.ZipInfo = self.zip_infos[name]
+        with open(self.archive_path, "rb") as archive:
+            archive.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", archive.read(4))
+            archive.seek(name_length + extra_length, os.SEEK_CUR)
+            remaining: int = info.compress_size
+            while remaining > 0:
+                chunk: bytes = archive.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise ValueError(f"{self.archive_path} is truncated.")
+                remaining -= len(chunk)
+                yield chunk
+
+
+class ZipWriter:
+    """Writes a zip file, compressing file chunks on a thread pool.
+
+    zlib releases the GIL while compressing, so threads compress chunks in
+    parallel. The writer keeps a bounded number of chunks in flight, which
+    bounds memory use regardless of file sizes."""
+
+    def __init__(self, output_file: BinaryIO, jobs: int = 0) -> None:
+        self.output_file: BinaryIO = output_file
+        self.entries: List[ZipEntry] = []
+        self.jobs: int = jobs or os.cpu_count() or 1
+
+    def write_local_header(self, entry: ZipEntry) -> None:
+        entry.offset = self.output_file.tell()
+        extra: bytes = b""
+        size_field: int = entry.size
+        compressed_size_field: int = entry.compressed_size
+        if entry.is_zip64:
+            extra = struct.pack("<HHQQ", 1, 16, entry.size, entry.compressed_size)
+            size_field = compressed_size_field = ZIP64_LIMIT
+        self.output_file.write(
+            struct.pack(
+                "<IHHHHHIIIHH",
+                0x04034B50,
+                entry.version_needed,
+                entry.flags,
+                entry.method,
+                DOS_TIME,
+                DOS_DATE,
+                entry.crc,
+                compressed_size_field,
+                size_field,
+                len(entry.encoded_name),
+                len(extra),
+            )
+        )
+        self.output_file.write(entry.encoded_name + extra)
+
+    def write_directory(self, name: str) -> None:
+        entry = ZipEntry(name + "/", ((stat.S_IFDIR | 0o755) << 16) | 0x10)
+        self.write_local_header(entry)
+        self.entries.append(entry)
+
+    def write_files(
+        self,
+        directory: str,
+        names: List[str],
+        previous_archive: Optional[PreviousArchive] = None,
+    ) -> None:
+        """Compresses and writes the files at the relative paths `names`.
+
+        If `previous_archive` is set, copies the compressed data of files that
+        didn't change from it."""
+
+        def generate_jobs() -> Iterator[Tuple[ZipEntry, bytes, bool, bool]]:
+            """Yields entries, their data chunks, whether it's their last chunk,
+            and whether the chunk is already compressed."""
+            for name in names:
+                path: str = os.path.join(directory, name)
+                file_stat = os.stat(path)
+                is_executable: bool = bool(file_stat.st_mode & 0o111)
+                mode: int = stat.S_IFREG | (0o755 if is_executable else 0o644)
+                extension: str = os.path.splitext(name)[1].lower()
+                entry = ZipEntry(
+                    name.replace(os.sep, "/"),
+                    mode << 16,
+                    ZIP_STORED if extension in STORED_EXTENSIONS else ZIP_DEFLATED,
+                    # Deflate can make data slightly bigger, like zipfile we
+                    # leave a margin.
+                    is_zip64=file_stat.st_size * 1.05 > ZIP64_LIMIT,
+                    size=file_stat.st_size,
+                    mtime_ns=file_stat.st_mtime_ns,
+                )
+                previous: Optional[dict] = None
+                if previous_archive is not None:
+                    previous = previous_archive.find_reusable_entry(entry, path)
+                if previous is not None:
+                    entry.crc = previous["crc"]
+                    compressed_chunks = previous_archive.read_compressed_chunks(name)
+                    for chunk, is_last in flag_last_chunk(compressed_chunks):
+                        yield entry, chunk, is_last, True
+                    continue
+
+                entry.size = 0
+                file_hash = hashlib.sha256()
+                for chunk, is_last in flag_last_chunk(read_chunks(path)):
+                    file_hash.update(chunk)
+                    if is_last:
+                        entry.sha256 = file_hash.hexdigest()
+                    yield entry, chunk, is_last, False
+
+        max_pending_chunks: int = self.jobs * 4
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            pending: Deque[Tuple[ZipEntry, bytes, bool, Optional[Future]]] = deque()
+            for entry, chunk, is_last, is_compressed in generate_jobs():
+                future: Optional[Future] = None
+                if not is_compressed:
+                    future = executor.submit(compress_chunk, chunk, entry.method, is_last)
+                pending.append((entry, chunk, is_last, future))
+                if len(pending) >= max_pending_chunks:
+                    self._write_chunk(*pending.popleft())
+            while pending:
+                self._write_chunk(*pending.popleft())
+
+    def _write_chunk(
+        self, entry: ZipEntry, chunk: bytes, is_last: bool, future: Optional[Future]
+    ) -> None:
+        """Writes a chunk of `entry`. If `future` is `None`, `chunk` is already
+        compressed data copied from a previous archive."""
+        if not self.entries or self.entries[-1] is not entry:
+            self.write_local_header(entry)
+            self.entries.append(entry)
+        if future is None:
+            self.output_file.write(chunk)
+            entry.compressed_size += len(chunk)
+        else:
+            compressed_chunk: bytes = future.result()
+            self.output_file.write(compressed_chunk)
+            entry.crc = zlib.crc32(chunk, entry.crc)
+            entry.size += len(chunk)
+            entry.compressed_size += len(compressed_chunk)
+        if is_last:
+            self._update_local_header(entry)
+
+    def _update_local_header(self, entry: ZipEntry) -> None:
+        """Writes the CRC and sizes of `entry` in its local header, once all
+        its data is written."""
+        if not entry.is_zip64 and max(entry.size, entry.compressed_size) >= ZIP64_LIMIT:
+            raise ValueError(f"{entry.name} grew over 4 GB while packaging it.")
+        end: int = self.output_file.tell()
+        self.output_file.seek(entry.offset + 14)
+        if entry.is_zip64:
+            self.output_file.write(struct.pack("<I", entry.crc))
+            self.output_file.seek(entry.offset + 30 + len(entry.encoded_name) + 4)
+            self.output_file.write(struct.pack("<QQ", entry.size, entry.compressed_size))
+        else:
+            self.output_file.write(
+                struct.pack("<III", entry.crc, entry.compressed_size, entry.size)
+            )
+        self.output_file.seek(end)
+
+    def get_manifest(self) -> dict:
+        """Returns the manifest of the files written so far."""
+        return {
+            "version": MANIFEST_VERSION,
+            "compression": COMPRESSION_SETTINGS,
+            "files": {
+                entry.name: {
+                    "size": entry.size,
+                    "mtime_ns": entry.mtime_ns,
+                    "sha256": entry.sha256,
+                    "crc": entry.crc,
+                    "method": entry.method,
+                }
+                for entry in self.entries
+                if not entry.name.endswith("/")
+            },
+        }
+
+    def close(self) -> None:
+        """Writes the central directory."""
+        central_directory_offset: int = self.output_file.tell()
+        for entry in self.entries:
+            zip64_fields: list = []
+            size, compressed_size, offset = entry.size, entry.compressed_size, entry.offset
+            if size >= ZIP64_LIMIT or entry.is_zip64:
+                zip64_fields.append(size)
+                size = ZIP64_LIMIT
+            if compressed_size >= ZIP64_LIMIT or entry.is_zip64:
+                zip64_fields.append(compressed_size)
+                compressed_size = ZIP64_LIMIT
+            if offset >= ZIP64_LIMIT:
+                zip64_fields.append(offset)
+                offset = ZIP64_LIMIT
+            extra: bytes = b""
+            version_needed: int = entry.version_needed
+            if zip64_fields:
+                extra = struct.pack(
+                    f"<HH{len(zip64_fields)}Q", 1, 8 * len(zip64_fields), *zip64_fields
+                )
+                version_needed = 45
+            self.output_file.write(
+                struct.pack(
+                    "<IHHHHHHIIIHHHHHII",
+                    0x02014B50,
+                    VERSION_MADE_BY,
+                    version_needed,
+                    entry.flags,
+                    entry.method,
+                    DOS_TIME,
+                    DOS_DATE,
+                    entry.crc,
+                    compressed_size,
+                    size,
+                    len(entry.encoded_name),
+                    len(extra),
+                    0,
+                    0,
+                    0,
+                    entry.external_attributes,
+                    offset,
+                )
+            )
+            self.output_file.write(entry.encoded_name + extra)
+
+        central_directory_end: int = self.output_file.tell()
+        central_directory_size: int = central_directory_end - central_directory_offset
+        count: int = len(self.entries)
+        if (
+            count >= ZIP_FILE_COUNT_LIMIT
+            or central_directory_size >= ZIP64_LIMIT
+            or central_directory_offset >= ZIP64_LIMIT
+        ):
+            self.output_file.write(
+                struct.pack(
+                    "<IQHHIIQQQQ",
+                    0x06064B50,
+                    44,
+                    VERSION_MADE_BY,
+                    45,
+                    0,
+                    0,
+                    count,
+                    count,
+                    central_directory_size,
+                    central_directory_offset,
+                )
+            )
+            self.output_file.write(
+                struct.pack("<IIQI", 0x07064B50, 0, central_directory_end, 1)
+            )
+            count = min(count, ZIP_FILE_COUNT_LIMIT)
+            central_directory_size = min(central_directory_size, ZIP64_LIMIT)
+            central_directory_offset = min(central_directory_offset, ZIP64_LIMIT)
+        self.output_file.write(
+            struct.pack(
+                "<IHHHHIIH",
+                0x06054B50,
+                0,
+                0,
+                count,
+                count,
+                central_directory_size,
+                central_directory_offset,
+                0,
+            )
+        )
+
+
+def write_manifest(manifest_path: str, manifest: dict) -> None:
+    with open_file_atomically(Path(manifest_path), "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+def package_project(
+    source_directory: str, output_path: str, jobs: int = 0, manifest_path: str = ""
+) -> None:
+    """Zips the project in `source_directory` to `output_path`.
+
+    Writes to a temporary file in the output directory first, so the build
+    never sees a partial archive. If `manifest_path` is set, reuses unchanged
+    files from the previous archive and updates the manifest."""
+    directories, files = find_files(source_directory)
+    previous_archive: Optional[PreviousArchive] = None
+    if manifest_path:
+        previous_archive = PreviousArchive(output_path, manifest_path)
+    with open_file_atomically(Path(output_path)) as output_file:
+        writer = ZipWriter(output_file, jobs)
+        for directory in directories:
+            writer.write_directory(directory.replace(os.sep, "/"))
+        writer.write_files(source_directory, files, previous_archive)
+        writer.close()
+    if manifest_path:
+        write_manifest(manifest_path, writer.get_manifest())
+
 
 def parse_command_line_arguments(args) -> argparse.Namespace:
     """Parses the command line arguments"""
@@ -36,6 +529,21 @@ def parse_command_line_arguments(args) -> argparse.Namespace:
         default="godot",
         help="Controls the output directory and zip file name.",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        help="Number of threads compressing files. Default: the number of CPU cores.",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=str,
+        default="",
+        help="Path to a manifest of the archived files. When set, files that didn't"
+        " change since the last run get copied from the existing archive.",
+    )
     return parser.parse_args(args)
 
 
@@ -62,17 +570,12 @@ def main():
         )
         sys.exit(ERROR_OUTPUT_DIRECTORY_INVALID)
 
-    with tempfile.TemporaryDirectory() as temporary_directory:
-        target_directory: str = os.path.join(temporary_directory, target_folder_name)
-        shutil.copytree(
-            src, target_directory, ignore=shutil.ignore_patterns(".import", ".git")
-        )
-        archive_path: str = shutil.make_archive(
-            target_folder_name, "zip", target_directory
-        )
-        if output_folder != ".":
-            output_filename: str = os.path.join(output_folder, os.path.basename(archive_path))
-            os.rename(archive_path, output_filename)
+    package_project(
+        src,
+        os.path.join(output_folder, target_folder_name + ".zip"),
+        args.jobs,
+        args.manifest,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+"""Runs pandoc jobs in parallel with a bounded number of processes.
+
+The number of concurrent jobs depends on the number of CPU cores and the
+available memory, as pandoc can use a lot of memory when it embeds media files
+in self-contained HTML documents.
+
+A single runner is meant to be shared by all the threads of a build, so the
+limit applies to the whole build and not to each caller."""
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+# Rough upper bound of the memory one pandoc process uses to render a
+# self-contained lesson with embedded pictures and videos.
+PANDOC_MEMORY_PER_JOB: int = 512 * 1024 * 1024
+
+
+def get_total_memory() -> int:
+    """Returns the physical memory in bytes, or 0 if unknown."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+def get_max_jobs() -> int:
+    """Returns the number of pandoc jobs that can run at the same time on this
+    computer."""
+    jobs: int = os.cpu_count() or 1
+    total_memory: int = get_total_memory()
+    if total_memory > 0:
+        jobs = min(jobs, total_memory // PANDOC_MEMORY_PER_JOB)
+    return max(jobs, 1)
+
+
+class PandocError(Exception):
+    """Raised when a pandoc job fails. The runner already printed pandoc's
+    error output, so the message only names the job."""
+
+    def __init__(self, result: "PandocResult") -> None:
+        super().__init__(f"pandoc failed on {result.job.name}")
+        self.result = result
+
+
+@dataclass
+class PandocJob:
+    command: List[str]
+    cwd: Optional[Path] = None
+    input: Optional[bytes] = None
+    name: str = ""
+
+
+@dataclass
+class PandocResult:
+    job: PandocJob
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+
+    @property
+    def succeeded(self) -> bool:
+        return self.returncode == 0
+
+
+class PandocRunner:
+    """Limits how many pandoc processes run at once.
+
+    Call `run()` from any thread to run a job and wait for its result, or
+    `submit()` to queue a job and get a future."""
+
+    def __init__(self, max_jobs: int = 0) -> None:
+        self.max_jobs: int = max_jobs or get_max_jobs()
+        self.errors: List[PandocResult] = []
+        self._semaphore = threading.BoundedSemaphore(self.max_jobs)
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def run(self, job: PandocJob) -> PandocResult:
+        """Runs `job` as soon as a slot is free and returns its result.
+
+        Prints errors as soon as the job fails. This is the only place that
+        prints them: callers raise `PandocError`, which only names the job."""
+        with self._semaphore:
+            out = subprocess.run(
+                job.command, input=job.input, capture_output=True, cwd=job.cwd
+            )
+        result = PandocResult(job, out.returncode, out.stdout, out.stderr)
+        if not result.succeeded:
+            with self._lock:
+                self.errors.append(result)
+            print(f"{job.name}: {result.stderr.decode()}", file=sys.stderr)
+        return result
+
+    def submit(self, job: PandocJob) -> Future:
+        """Queues `job` and returns a future resolving to its `PandocResult`."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_jobs)
+        return self._executor.submit(self.run, job)
+
+    def run_all(self, jobs: Sequence[PandocJob]) -> List[PandocResult]:
+        """Runs all `jobs` in parallel and returns their results in order."""
+        futures: List[Future] = [self.submit(job) for job in jobs]
+        return [future.result() for future in futures]
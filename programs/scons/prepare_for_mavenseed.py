@@ -3,8 +3,10 @@
 Mavenseed."""
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Sequence
+from typing import Dict, Iterable, List, Optional, Sequence, TextIO
+import os
 import re
+import threading
 
 from datargs import arg, parse
 
@@ -28,6 +30,31 @@ class Args:
     overwrite: bool = arg(
         default=False, help="If True, overwrite existing output files.", aliases=["-w"]
     )
+    batch: bool = arg(
+        default=False,
+        aliases=["-b"],
+        help="Process every html file in the given directories. Each file goes to a"
+        " subdirectory of the output directory named after the file's directory.",
+    )
+
+
+# The h1 tag comes after the document's head, which contains the CSS. We read
+# files in chunks and stop at the first h1 tag, without reading past
+# MAX_H1_SEARCH_SIZE bytes, to skip embedded pictures and videos.
+READ_CHUNK_SIZE: int = 64 * 1024
+MAX_H1_SEARCH_SIZE: int = 1024 * 1024
+RE_H1_ID: re.Pattern = re.compile(rb'<h1 id="([^"]+)"')
+
+# Markers the streaming rewriter looks for in the body. Embedded pictures and
+# videos are data URIs in src attributes, which we copy without scanning them
+# for links.
+BODY_START: str = "<body>"
+BODY_END: str = "</body>"
+HREF_START: str = 'href="'
+DATA_URI_START: str = '="data:'
+BODY_MARKERS: List[str] = [HREF_START, DATA_URI_START, BODY_END]
+# Links longer than this get copied as-is, to bound the memory we use.
+MAX_LINK_SIZE: int = 4096
 
 
 def extract_html_body(html: str) -> str:
@@ -37,39 +64,207 @@ def extract_html_body(html: str) -> str:
     return html[body_start:body_end]
 
 
-def replace_links(html: str) -> str:
+def read_h1_id(html_file: Path) -> str:
+    """Returns the ID of the first h1 tag in `html_file`, reading only the start
+    of the file."""
+    head: bytes = b""
+    with open(html_file, "rb") as f:
+        while len(head) < MAX_H1_SEARCH_SIZE:
+            chunk: bytes = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            # A tag may span two chunks, so we search from a bit before the new
+            # chunk.
+            search_start: int = max(len(head) - 256, 0)
+            head += chunk
+            match = RE_H1_ID.search(head, search_start)
+            if match:
+                return match.group(1).decode("utf-8")
+    return ""
+
+
+class H1IdIndex:
+    """Maps html file names to the ID of their h1 tag.
+
+    Build it once per run: it lists files once and reads each file's h1 ID at
+    most once, the first time a document links to it."""
+
+    def __init__(self, files: Dict[str, Path], search_directory: str = "") -> None:
+        self.files: Dict[str, Path] = files
+        self.search_directory: str = search_directory
+        self._ids: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_directory(cls, directory: Path) -> "H1IdIndex":
+        """Indexes all the html files in `directory` and its subdirectories."""
+        files: Dict[str, Path] = {}
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(".html"):
+                    files.setdefault(filename, Path(dirpath, filename))
+        return cls(files, str(directory))
+
+    @classmethod
+    def from_files(cls, file_paths: Iterable[Path]) -> "H1IdIndex":
+        files: Dict[str, Path] = {}
+        for file_path in file_paths:
+            files.setdefault(Path(file_path).name, Path(file_path))
+        return cls(files)
+
+    def get_id(self, html_file_name: str) -> str:
+        """Returns the h1 ID of the file named `html_file_name`, or an empty
+        string if there's no such file or it has no h1 tag."""
+        with self._lock:
+            if html_file_name in self._ids:
+                return self._ids[html_file_name]
+        html_file: Optional[Path] = self.files.get(html_file_name)
+        if html_file is None:
+            print(f"Unable to find {html_file_name} in {self.search_directory}")
+            h1_id = ""
+        else:
+            h1_id = read_h1_id(html_file)
+        with self._lock:
+            self._ids[html_file_name] = h1_id
+        return h1_id
+
+
+def replace_link_target(link: str, h1_id_index: H1IdIndex) -> str:
+    """Returns the h1 ID of the document `link` points to, or `link` itself if
+    it's an external link, an anchor, or the document isn't found."""
+    if link == "" or "\n" in link or re.match(r"http|\/\/|#", link):
+        return link
+    target_filename = Path(link).name
+    if not target_filename.endswith(".html"):
+        target_filename += ".html"
+    title_id = h1_id_index.get_id(target_filename)
+    return title_id if title_id else link
+
+
+def replace_links(html: str, h1_id_index: H1IdIndex) -> str:
     """Finds links in the html document and removes the leading directory."""
 
     def replace_link(match):
-        link = match.group(1)
-        target_filename = Path(link).name
-        if not target_filename.endswith(".html"):
-            target_filename += ".html"
-        title_id = get_document_h1_id(target_filename)
-        return f'href="{title_id}"' if title_id else f'href="{link}"'
+        return f'href="{replace_link_target(match.group(1), h1_id_index)}"'
 
     return re.sub(r'href="(?!http|\/\/|#)(.+?)"', replace_link, html)
 
 
-def get_document_h1_id(html_file_name: str) -> str:
-    """Finds the html file by name from MAVENSEED_DIRECTORY and returns its h1
-    tag's ID."""
+def stream_html_body(
+    input_file: TextIO,
+    output_file: TextIO,
+    h1_id_index: H1IdIndex,
+    chunk_size: int = READ_CHUNK_SIZE,
+) -> int:
+    """Copies the content of the <body> tag of `input_file` to `output_file`,
+    replacing links like `replace_links()`, and returns the number of
+    characters written.
+
+    Reads and writes the file in chunks, so memory use doesn't depend on the
+    size of the document. Data URIs get copied without searching them for
+    links."""
+    buffer: str = ""
+    is_end_of_file: bool = False
+    written: int = 0
+
+    def read_chunk() -> None:
+        nonlocal buffer, is_end_of_file
+        chunk: str = input_file.read(chunk_size)
+        is_end_of_file = chunk == ""
+        buffer += chunk
+
+    def write(text: str) -> None:
+        nonlocal written
+        output_file.write(text)
+        written += len(text)
+
+    # Skip the head, keeping only enough text to find a tag that spans two
+    # chunks.
+    while True:
+        read_chunk()
+        start: int = buffer.find(BODY_START)
+        if start != -1:
+            buffer = buffer[start + len(BODY_START) :]
+            break
+        if is_end_of_file:
+            raise ValueError("The document has no <body> tag.")
+        buffer = buffer[-len(BODY_START) :]
+
+    marker_overlap: int = max(len(marker) for marker in BODY_MARKERS) - 1
+    while True:
+        matches: List[tuple] = [
+            (index, marker)
+            for marker in BODY_MARKERS
+            for index in [buffer.find(marker)]
+            if index != -1
+        ]
+        if not matches:
+            if is_end_of_file:
+                raise ValueError("The document has no </body> tag.")
+            if len(buffer) > marker_overlap:
+                write(buffer[:-marker_overlap])
+                buffer = buffer[-marker_overlap:]
+            read_chunk()
+            continue
+
+        index, marker = min(matches)
+        write(buffer[:index])
+        if marker == BODY_END:
+            return written
+        write(marker)
+        buffer = buffer[index + len(marker) :]
 
-    def find_file_by_name(file_name: str) -> Path:
-        """Finds the file with the name file_name inside any subdirectory of the
-        mavenseed_directory."""
-        matching_files = list(DIST_DIRECTORY.rglob("**/" + file_name))
-        return matching_files[0] if matching_files else None
+        is_data_uri: bool = marker == DATA_URI_START
+        if marker == HREF_START:
+            while len(buffer) < len("data:") and not is_end_of_file:
+                read_chunk()
+            is_data_uri = buffer.startswith("data:")
 
-    html_file = find_file_by_name(html_file_name)
-    if html_file is None:
-        print(f"Unable to find {html_file_name} in {DIST_DIRECTORY}")
-        return ""
+        if is_data_uri:
+            # Copy the payload up to the closing quote, which stays in the
+            # buffer.
+            end: int = buffer.find('"')
+            while end == -1 and not is_end_of_file:
+                write(buffer)
+                buffer = ""
+                read_chunk()
+                end = buffer.find('"')
+            if end != -1:
+                write(buffer[:end])
+                buffer = buffer[end:]
+            continue
 
-    with open(html_file, "r") as f:
-        html = f.read()
-        match = re.search(r'<h1 id="([^"]+)"', html)
-        return match.group(1) if match else ""
+        end = buffer.find('"')
+        while end == -1 and len(buffer) < MAX_LINK_SIZE and not is_end_of_file:
+            read_chunk()
+            end = buffer.find('"')
+        if end != -1:
+            write(replace_link_target(buffer[:end], h1_id_index))
+            buffer = buffer[end:]
+
+
+def prepare_file(path: Path, output_file: TextIO, h1_id_index: H1IdIndex) -> int:
+    """Writes the body of the html file at `path` with links replaced to
+    `output_file` and returns the number of characters written."""
+    with open(path) as f_in:
+        try:
+            return stream_html_body(f_in, output_file, h1_id_index)
+        except ValueError as error:
+            raise ValueError(f"{path}: {error}") from error
+
+
+def find_html_files(directory: Path, ignore_directory: Path) -> List[Path]:
+    """Returns the html files in `directory` and its subdirectories, except for
+    those in `ignore_directory`."""
+    ignore_path: str = os.path.abspath(ignore_directory)
+    html_files: List[Path] = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = sorted(
+            d for d in dirnames if os.path.abspath(os.path.join(dirpath, d)) != ignore_path
+        )
+        html_files += [Path(dirpath, f) for f in sorted(filenames) if f.endswith(".html")]
+    return html_files
 
 
 def main():
@@ -83,43 +278,49 @@ def main():
         return None
 
     args: Args = parse(Args)
-    valid_filepaths: List[Path] = [p for p in args.filepaths if p.suffix == ".html"]
+    if args.batch:
+        valid_filepaths: List[Path] = [
+            path
+            for directory in args.filepaths
+            for path in find_html_files(directory, args.output_directory)
+        ]
+    else:
+        valid_filepaths = [p for p in args.filepaths if p.suffix == ".html"]
 
     if not args.output_directory.exists():
         print(f"Creating directory: {args.output_directory}")
         args.output_directory.mkdir(parents=True)
 
-    global DIST_DIRECTORY
-    DIST_DIRECTORY = find_dist_directory(valid_filepaths[0])
-    if DIST_DIRECTORY is None:
+    dist_directory = find_dist_directory(valid_filepaths[0])
+    if dist_directory is None:
         print("Unable to find mavenseed directory.")
         exit(1)
+    h1_id_index = H1IdIndex.from_directory(dist_directory)
 
     # Extract the body tag, replace links and move files to the output
     # directory.
     overwrite_all: bool = args.overwrite
     for path in valid_filepaths:
-        with open(path) as f_in:
-            html: str = f_in.read()
-            html_body: str = extract_html_body(html)
-            html_body = replace_links(html_body)
-            out_path: Path = args.output_directory / (path.stem + ".html")
-
-            if not overwrite_all and out_path.exists():
-                overwrite_prompt = f"""{out_path} already exists. Overwrite?
-
-                - [y]: yes for this file
-                - [N]: no for this file
-                - [A]: yes to all"""
-                prompt: str = input(overwrite_prompt)
-                overwrite_all = prompt == "A"
-                overwrite_this_file: bool = prompt.lower() == "y"
-
-                if not overwrite_this_file:
-                    continue
-            with open(out_path, "w") as f_out:
-                f_out.write(html_body)
-                print(f"Wrote {out_path}")
+        out_path: Path = args.output_directory / (path.stem + ".html")
+        if args.batch:
+            out_path = args.output_directory / path.parent.name / (path.stem + ".html")
+
+        if not overwrite_all and out_path.exists():
+            overwrite_prompt = f"""{out_path} already exists. Overwrite?
+
+            - [y]: yes for this file
+            - [N]: no for this file
+            - [A]: yes to all"""
+            prompt: str = input(overwrite_prompt)
+            overwrite_all = prompt == "A"
+            overwrite_this_file: bool = prompt.lower() == "y"
+
+            if not overwrite_this_file:
+                continue
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(out_path, "w") as f_out:
+            prepare_file(path, f_out, h1_id_index)
+        print(f"Wrote {out_path}")
 
     if args.print_files:
         print("\n".join(str(p) for p in valid_filepaths))
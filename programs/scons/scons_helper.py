@@ -1,50 +1,44 @@
-import subprocess
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Dict, List
 
 import colorama
-from SCons.Script import Dir, File
+from SCons.Action import FunctionAction
+from SCons.Script import Action, Builder, Dir, Environment, File
 
+import git_tags
+from anchor_index import strip_anchor_comments
+from build_cache import write_file_atomically
+from build_trace import CATEGORY_GODOT, Tracer
 
-def get_godot_project_files(dir: Dir, ignore_directories: List[str] = []) -> list[Path]:
-    """Return a list of all folders containing a project.godot file"""
-    directory: Path = Path(str(dir))
-    subdirectories: List[Path] = [
-        Path(str(d))
-        for d in directory.iterdir()
-        if d.is_dir() and not d.name in ignore_directories and not d.name.startswith(".")
-    ]
-    return [
-        p for d in subdirectories for p in d.glob("**/project.godot")
-    ]
+# Below this number of files, starting threads costs more than it saves.
+STRIP_ANCHORS_THREAD_THRESHOLD: int = 16
 
 
-def validate_git_versions(source_dir: Dir) -> bool:
-    """Compares git release tags, of root and godot projects to make sure they are identical"""
-    godot_project_dirs = [pf.Dir(".") for pf in get_godot_project_files(source_dir)]
-    godot_project_dirs.append(source_dir)
+def validate_git_versions(source_dir: Dir, godot_project_files: List[Path]) -> bool:
+    """Compares git release tags, of root and godot projects to make sure they are identical.
 
-    results = {}
-    for godot_project_dir in godot_project_dirs:
-        out = subprocess.run(
-            ["git", "describe", "--tags"], capture_output=True, cwd=godot_project_dir
-        )
-        if out.returncode != 0:
-            print_error(out.stderr.decode())
-            raise Exception(out.stderr.decode())
-        results[godot_project_dir.name] = out.stdout.decode().strip()
+    Reads tags from the git directories when possible and runs `git describe`
+    in parallel otherwise."""
+    directories: List[Path] = [Path(str(source_dir))] + [
+        project_file.parent for project_file in godot_project_files
+    ]
+    try:
+        tags: Dict[Path, str] = git_tags.describe_all(directories)
+    except git_tags.GitDescribeError as error:
+        print_error(str(error))
+        raise
 
-    ret = False
-    if len(set(results.values())) == 1:
+    if len(set(tags.values())) == 1:
         # All git versions match
-        ret = True
+        return True
 
     print_error("WARNING: Multiple git release tags found!")
-    for key, value in results.items():
-        print_error(key + " : " + value)
-
-    return ret
+    for directory, tag in tags.items():
+        print_error(directory.name + " : " + tag)
+    return False
 
 
 def calculate_target_file_paths(
@@ -58,6 +52,113 @@ def calculate_target_file_paths(
     ]
 
 
+def get_files_size(nodes: list[File]) -> int:
+    """Returns the total size in bytes of the nodes that are files."""
+    paths = (str(node) for node in nodes)
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+
+class TracedCommandAction(FunctionAction):
+    """Runs a command action in a span of the build trace.
+
+    The action has the same build signature and implicit dependencies as the
+    command, so turning tracing on or off doesn't rebuild targets, and changing
+    the command's arguments does."""
+
+    def __init__(self, command_action, tracer: Tracer, name: str, category: str):
+        self.command_action = command_action
+        self.tracer: Tracer = tracer
+        self.span_name: str = name
+        self.category: str = category
+        super().__init__(
+            self.run_traced_command, {"strfunction": command_action.strfunction}
+        )
+
+    def run_traced_command(self, target, source, env):
+        with self.tracer.span(self.span_name, self.category, str(source[0])) as span:
+            span.bytes_in = get_files_size(source)
+            # This action already printed the command.
+            result = self.command_action(target, source, env, show=False)
+            span.bytes_out = get_files_size(target)
+        return result
+
+    def get_presig(self, target, source, env, executor=None):
+        return self.command_action.get_presig(target, source, env, executor)
+
+    def get_implicit_deps(self, target, source, env, executor=None):
+        return self.command_action.get_implicit_deps(target, source, env, executor)
+
+    def get_varlist(self, target, source, env, executor=None):
+        return self.command_action.get_varlist(target, source, env, executor)
+
+
+def trace_command(tracer: Tracer, command: list, name: str, category: str) -> list:
+    """Returns the action list to run `command` with.
+
+    If tracing is enabled, the command runs in a Python action that records a
+    span with the size of the sources and targets."""
+    if not tracer.is_enabled:
+        return [command]
+    return [TracedCommandAction(Action([command]), tracer, name, category)]
+
+
+def strip_anchors(target: list[File], source: list[File], env: Environment) -> None:
+    """Copies GDScript files without their anchor comments.
+
+    SCons passes every file of the batch to the action, so we only process the
+    files whose target is out of date, in-process instead of running one sed
+    command per file."""
+
+    def strip_file(paths: tuple) -> None:
+        target_path, source_path = paths
+        with open(source_path, "r", encoding="utf-8", newline="") as source_file:
+            content: str = source_file.read()
+        write_file_atomically(
+            Path(target_path), strip_anchor_comments(content).encode("utf-8")
+        )
+
+    changed_files: list[tuple] = [
+        (t, s) for t, s in zip(target, source) if t.always_build or not t.is_up_to_date()
+    ]
+    paths = [(str(t), str(s)) for t, s in changed_files]
+    if not paths:
+        return
+    with env["TRACER"].span("remove anchors", CATEGORY_GODOT, paths[0][1]) as span:
+        if len(paths) < STRIP_ANCHORS_THREAD_THRESHOLD:
+            for file_paths in paths:
+                strip_file(file_paths)
+        else:
+            with ThreadPoolExecutor(max_workers=env.GetOption("num_jobs")) as executor:
+                list(executor.map(strip_file, paths))
+        span.bytes_in = get_files_size([s for _, s in changed_files])
+        span.bytes_out = get_files_size([t for t, _ in changed_files])
+
+
+def get_strip_anchors_batch_key(action, env: Environment, target, source):
+    """Puts all the files to strip anchors from in one batch."""
+    return (id(action), id(env))
+
+
+def emit_precious_targets(target: list, source: list, env: Environment) -> tuple:
+    """Marks the targets as precious.
+
+    Before running a batch, SCons deletes all its targets, including the ones
+    that are up to date. Precious targets stay, so the action can skip them."""
+    env.Precious(target)
+    return target, source
+
+
+STRIP_ANCHORS_BUILDER = Builder(
+    action=Action(
+        strip_anchors,
+        "Removing anchor comments from $CHANGED_SOURCES",
+        batch_key=get_strip_anchors_batch_key,
+    ),
+    emitter=emit_precious_targets,
+    single_source=True,
+)
+
+
 def print_success(*args, **kwargs):
     print(colorama.Fore.GREEN, end="", flush=True)
     print(*args, **kwargs)
@@ -0,0 +1,121 @@
+"""Lists the files of a source directory once per build, reusing the listings
+of unchanged directories from the previous build.
+
+Adding, removing, or renaming a file updates the modification time of its
+directory. So if a directory's modification time is the same as in the
+previous build, its list of files and subdirectories is the same too, and we
+don't need to list it again. We still check every subdirectory, as changes
+inside a subdirectory don't update the parent's modification time.
+"""
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from build_cache import open_file_atomically
+
+SNAPSHOT_VERSION: int = 1
+# A directory modified right before the snapshot was taken may change again
+# with the same modification time, depending on the file system's timestamp
+# resolution. We list such directories again, like git does with racily
+# clean files.
+RACY_TIME_NS: int = 2 * 1_000_000_000
+
+
+class SourceTree:
+    """Lists files and directories under `root`, each directory at most once.
+
+    If `snapshot_path` is set, reuses the listings saved by the previous run
+    for directories whose modification time didn't change. Call `save()` to
+    write the listings of this run."""
+
+    def __init__(self, root: Path, snapshot_path: Optional[Path] = None) -> None:
+        self.root: str = os.path.abspath(str(root))
+        self.snapshot_path: Optional[Path] = snapshot_path
+        self._snapshot: Dict[str, dict] = {}
+        self._snapshot_time_ns: int = 0
+        self._listings: Dict[str, dict] = {}
+        # Listings are at least as recent as this time.
+        self._start_time_ns: int = time.time_ns()
+        if snapshot_path is not None:
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.snapshot_path, "r") as snapshot_file:
+                data: dict = json.load(snapshot_file)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == SNAPSHOT_VERSION and data.get("root") == self.root:
+            self._snapshot = data["directories"]
+            self._snapshot_time_ns = data["time_ns"]
+
+    def save(self) -> None:
+        """Writes the listings of the directories visited in this run."""
+        if self.snapshot_path is None:
+            return
+        with open_file_atomically(self.snapshot_path, "w") as snapshot_file:
+            json.dump(
+                {
+                    "version": SNAPSHOT_VERSION,
+                    "root": self.root,
+                    "time_ns": self._start_time_ns,
+                    "directories": self._listings,
+                },
+                snapshot_file,
+            )
+
+    def list_directory(self, directory: Path) -> Tuple[List[str], List[str]]:
+        """Returns the names of the subdirectories and files in `directory`."""
+        path: str = os.path.abspath(str(directory))
+        key: str = os.path.relpath(path, self.root)
+        if key not in self._listings:
+            mtime_ns: int = os.stat(path).st_mtime_ns
+            listing: Optional[dict] = self._snapshot.get(key)
+            is_unchanged: bool = (
+                listing is not None
+                and listing["mtime_ns"] == mtime_ns
+                and mtime_ns < self._snapshot_time_ns - RACY_TIME_NS
+            )
+            if not is_unchanged:
+                directories: List[str] = []
+                files: List[str] = []
+                # Like pathlib's recursive glob, we don't follow symbolic links
+                # to directories.
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.name)
+                        elif entry.is_file():
+                            files.append(entry.name)
+                listing = {
+                    "mtime_ns": mtime_ns,
+                    "directories": sorted(directories),
+                    "files": sorted(files),
+                }
+            self._listings[key] = listing
+        listing = self._listings[key]
+        return listing["directories"], listing["files"]
+
+    def get_subdirectories(self, directory: Path) -> List[Path]:
+        directories, _ = self.list_directory(directory)
+        return [Path(str(directory), name) for name in directories]
+
+    def walk(self, directory: Path) -> Iterator[Tuple[Path, List[str], List[str]]]:
+        """Yields each directory under `directory`, including itself, with the
+        names of its subdirectories and files, like `os.walk()`."""
+        stack: List[Path] = [Path(str(directory))]
+        while stack:
+            current: Path = stack.pop()
+            directories, files = self.list_directory(current)
+            yield current, directories, files
+            stack += [current / name for name in reversed(directories)]
+
+    def find_files(self, directory: Path) -> List[Path]:
+        """Returns the paths of all files under `directory`, recursively."""
+        return [
+            current / name
+            for current, _, files in self.walk(directory)
+            for name in files
+        ]
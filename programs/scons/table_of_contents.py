@@ -9,6 +9,7 @@ import sys
 from dataclasses import dataclass
 import logging
 
+from document import BlockTypes, Document
 from scons_helper import print_error
 
 ERROR_COULD_NOT_OPEN_INPUT_FILE: int = 1
@@ -25,35 +26,31 @@ class Heading:
     level: int
 
 
-RE_HEADING: re.Pattern = re.compile(r"^(#+)(.+)$")
 RE_TEMPLATE_CONTENTS: re.Pattern = re.compile(r"^{% contents %}")
-RE_SPLIT_CODE_BLOCK: re.Pattern = re.compile(r"(```[a-z]*.*?```)", flags=re.DOTALL)
 
 
-def find_headings(text: str) -> List[Heading]:
+def find_headings_in_document(document: Document) -> List[Heading]:
     out: List[Heading] = []
 
-    blocks = RE_SPLIT_CODE_BLOCK.split(text)
-    for block in blocks:
-        if block.startswith("```"):
+    for block in document.get_blocks(BlockTypes.heading):
+        line: str = block.text
+        # Skip document title
+        if line.startswith("# "):
             continue
 
-        lines = block.split("\n")
-        heading_lines = [line for line in lines if RE_HEADING.search(line) is not None]
-        for line in heading_lines:
-            # Skip document title
-            if line.startswith("# "):
-                continue
-
-            title: str = line.lstrip("# ").rstrip("\n")
-            anchor: str = title.lower().replace(" ", "-").replace("'", "").rstrip("?!")
-            # Subtract 2 so level-2 headings are unindented
-            level: int = line.split(" ", 1)[0].count("#") - 2
-            out.append(Heading(title, anchor, level))
+        title: str = line.lstrip("# ").rstrip("\n")
+        anchor: str = title.lower().replace(" ", "-").replace("'", "").rstrip("?!")
+        # Subtract 2 so level-2 headings are unindented
+        level: int = line.split(" ", 1)[0].count("#") - 2
+        out.append(Heading(title, anchor, level))
 
     return out
 
 
+def find_headings(text: str) -> List[Heading]:
+    return find_headings_in_document(Document.parse(text))
+
+
 def generate_table_of_contents(
     headings: List[Heading], max_level: int = 3
 ) -> List[str]:
@@ -69,20 +66,22 @@ def generate_table_of_contents(
     return out
 
 
+def process_parsed_document(document: Document) -> None:
+    """Finds and replace a template with the form {% contents %} outside code
+    blocks."""
+    for block in document.get_blocks(BlockTypes.template):
+        if block.text == "{% contents %}":
+            headings: List[Heading] = find_headings_in_document(document)
+            block.text = "\n".join(generate_table_of_contents(headings))
+            block.type = BlockTypes.text
+            break
+
+
 def replace_contents_template(content: str) -> str:
     """Finds and replace a template with the form {% contents %}"""
-    output: List[str] = content.split("\n")
-
-    index = 0
-    split_content: List[str] = output
-    for line in split_content:
-        if line == "{% contents %}":
-            headings: List[Heading] = find_headings(content)
-            table_of_contents: List[str] = generate_table_of_contents(headings)
-            output = split_content[:index] + table_of_contents + split_content[index + 1 :]
-            break
-        index += 1
-    return "\n".join(output)
+    document = Document.parse(content)
+    process_parsed_document(document)
+    return document.serialize()
 
 
 def get_file_content(file_path: str) ->str:
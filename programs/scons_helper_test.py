@@ -0,0 +1,59 @@
+"""Tests for the scons_helper module."""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("SCons")
+
+SCONS_DIRECTORY: Path = Path(__file__).parent / "scons"
+SCRIPT_NAMES = ["a.gd", "b.gd", "c.gd"]
+SCONSTRUCT = """
+import sys
+sys.path.append({scons_directory!r})
+from build_trace import Tracer
+from scons_helper import STRIP_ANCHORS_BUILDER
+
+env = Environment(
+    TRACER=Tracer(is_enabled=False), BUILDERS={{"StripAnchors": STRIP_ANCHORS_BUILDER}}
+)
+for name in {script_names!r}:
+    env.StripAnchors("build/" + name, name)
+"""
+
+
+def run_scons(directory: Path) -> None:
+    subprocess.run(
+        [sys.executable, "-c", "import SCons.Script; SCons.Script.main()", "-Q"],
+        cwd=directory,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def test_strip_anchors_only_rewrites_changed_scripts(tmp_path):
+    (tmp_path / "SConstruct").write_text(
+        SCONSTRUCT.format(
+            scons_directory=str(SCONS_DIRECTORY), script_names=SCRIPT_NAMES
+        )
+    )
+    for name in SCRIPT_NAMES:
+        (tmp_path / name).write_text("# ANCHOR: a\nvar a\n# END: a\n")
+    run_scons(tmp_path)
+    build_directory = tmp_path / "build"
+    assert (build_directory / "a.gd").read_text() == "var a\n"
+    inodes = {name: os.stat(build_directory / name).st_ino for name in SCRIPT_NAMES}
+
+    with open(tmp_path / "b.gd", "a") as script:
+        script.write("var b\n")
+    run_scons(tmp_path)
+    assert (build_directory / "b.gd").read_text() == "var a\nvar b\n"
+    changed = [
+        name
+        for name in SCRIPT_NAMES
+        if os.stat(build_directory / name).st_ino != inodes[name]
+    ]
+    assert changed == ["b.gd"]
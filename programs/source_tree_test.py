@@ -0,0 +1,75 @@
+"""Tests for the source_tree module."""
+import os
+from pathlib import Path
+
+from source_tree import SourceTree
+
+
+def create_tree(directory: Path) -> None:
+    (directory / "b").mkdir()
+    (directory / "a" / "nested").mkdir(parents=True)
+    (directory / "a" / "nested" / "file.md").write_text("")
+    (directory / "a" / "file.md").write_text("")
+    (directory / "root.md").write_text("")
+
+
+def test_lists_files_recursively(tmp_path):
+    create_tree(tmp_path)
+    tree = SourceTree(tmp_path)
+    assert tree.get_subdirectories(tmp_path) == [tmp_path / "a", tmp_path / "b"]
+    assert tree.find_files(tmp_path) == [
+        tmp_path / "root.md",
+        tmp_path / "a" / "file.md",
+        tmp_path / "a" / "nested" / "file.md",
+    ]
+
+
+def set_old_modification_times(directory: Path) -> None:
+    """Makes directories look modified long before any snapshot, so they
+    aren't racily clean."""
+    old_time_ns = 1_000_000_000
+    for path in [directory, *directory.rglob("*")]:
+        if path.is_dir():
+            os.utime(path, ns=(old_time_ns, old_time_ns))
+
+
+def test_snapshot_reuses_unchanged_directories(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    create_tree(source)
+    set_old_modification_times(source)
+    snapshot_path = tmp_path / "snapshot.json"
+    tree = SourceTree(source, snapshot_path)
+    tree.find_files(source)
+    tree.save()
+
+    # A file created without changing its directory's modification time
+    # doesn't show up, as the directory's listing comes from the snapshot.
+    (source / "a" / "hidden.md").write_text("")
+    set_old_modification_times(source)
+    (source / "b" / "new.md").write_text("")
+    assert SourceTree(source, snapshot_path).find_files(source) == [
+        source / "root.md",
+        source / "a" / "file.md",
+        source / "a" / "nested" / "file.md",
+        source / "b" / "new.md",
+    ]
+
+
+def test_racily_clean_directories_are_listed_again(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    create_tree(source)
+    snapshot_path = tmp_path / "snapshot.json"
+    tree = SourceTree(source, snapshot_path)
+    tree.find_files(source)
+    tree.save()
+
+    # The directories were modified less than RACY_TIME_NS before the
+    # snapshot, so the same modification time doesn't prove they're unchanged.
+    modification_time_ns = os.stat(source / "b").st_mtime_ns
+    (source / "b" / "new.md").write_text("")
+    os.utime(source / "b", ns=(modification_time_ns, modification_time_ns))
+    assert source / "b" / "new.md" in SourceTree(source, snapshot_path).find_files(
+        source
+    )
@@ -5,16 +5,22 @@ Each function handles one linter rule."""
 import inspect
 import re
 import sys
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
-from typing import Callable, Dict, List, Sequence
+from typing import Callable, Dict, List, Optional, Sequence
 
 import yaml
 from datargs import arg, parse
 
 from lib.gdscript_classes import BUILT_IN_CLASSES
 
+# The anchor index is shared with the build system in this directory.
+SCONS_DIRECTORY: Path = Path(__file__).parent / "scons"
+sys.path.append(str(SCONS_DIRECTORY))
+
+from anchor_index import AnchorIndex, get_index_path
+
 ERROR_FILE_DOES_NOT_EXIST = 1
 ERROR_ISSUES_FOUND = 2
 
@@ -77,6 +83,8 @@ class Document:
     lines: List[str]
     content: str
     git_directory: Path = None
+    # Index of the anchors in the project's files, see scons/anchor_index.py.
+    anchor_index: AnchorIndex = field(default_factory=AnchorIndex)
 
     def __post_init__(self):
         self.git_directory = self.find_git_directory()
@@ -271,23 +279,16 @@ def check_includes(document: Document, args: Args) -> List[Issue]:
                 "include_file_path must be a valid file to run this function."
             )
         issue = None
-        anchor_re = re.compile(
-            r"^\s*# ?ANCHOR: ?{}\s*\n(.+)\n\s*# ?END: ?{}".format(
-                include_anchor, include_anchor
-            ),
-            flags=re.DOTALL | re.MULTILINE,
-        )
-        with open(include_file_path, "r") as include_file:
-            content = include_file.read()
-            match = anchor_re.search(content)
-            if not match:
-                issue = Issue(
-                    line=index,
-                    column_start=0,
-                    column_end=0,
-                    message=f"Include anchor {include_anchor} not found in {include_file_path}.",
-                    rule=Rules.include_anchor_not_found,
-                )
+        indexed_file = document.anchor_index.get_file(include_file_path)
+        if include_anchor not in indexed_file.anchors:
+            issue = Issue(
+                line=index,
+                column_start=0,
+                column_end=0,
+                message=f"Include anchor {include_anchor} not found in {include_file_path}.",
+                rule=Rules.include_anchor_not_found,
+                error="\n".join(indexed_file.errors),
+            )
         return issue
 
     issues = []
@@ -505,11 +506,18 @@ def check_statements_with_slashes(document: Document, args: Args) -> List[Issue]
     return issues
 
 
-def lint(path: Path, args: Args) -> List[Issue]:
+def lint(
+    path: Path,
+    args: Args,
+    get_anchor_index: Optional[Callable[[Path], AnchorIndex]] = None,
+) -> List[Issue]:
     """Lint a tutorial.
 
     Arguments:
         path: path to the tutorial
+        get_anchor_index: function returning the anchor index of a project
+        directory. By default, anchors get indexed in memory for this document
+        only.
     """
     issues = []
     check_functions: List[Function] = [
@@ -518,6 +526,8 @@ def lint(path: Path, args: Args) -> List[Issue]:
     with open(path) as input_file:
         lines = input_file.readlines()
         document = Document(path=path, lines=lines, content="".join(lines))
+        if get_anchor_index is not None:
+            document.anchor_index = get_anchor_index(document.git_directory)
         for check_function in check_functions:
             issues += check_function.function(document, args)
     return issues
@@ -535,12 +545,21 @@ def get_all_functions_in_module() -> List[Function]:
 def main():
     args = parse(Args)
     issues_found: bool = False
+    anchor_indexes: Dict[Path, AnchorIndex] = {}
+
+    def get_anchor_index(project_directory: Path) -> AnchorIndex:
+        if project_directory not in anchor_indexes:
+            anchor_indexes[project_directory] = AnchorIndex(
+                get_index_path(project_directory)
+            )
+        return anchor_indexes[project_directory]
+
     for path in args.input_files:
         if not path.is_file():
             print(f"{path} does not exist. Exiting.")
             exit(ERROR_FILE_DOES_NOT_EXIST)
 
-        issues = lint(path, args)
+        issues = lint(path, args, get_anchor_index)
         if issues:
             issues_found = True
             print(f"Found {len(issues)} issues in{path}.\n")
@@ -550,6 +569,8 @@ def main():
                 )
                 if args.print_errors and issue.error:
                     print(f"\nError message:\n\n{issue.error}")
+    for anchor_index in anchor_indexes.values():
+        anchor_index.save()
     if issues_found:
         exit(ERROR_ISSUES_FOUND)
 
@@ -1,2 +1,26 @@
 """Tests for the tutorial_linter module."""
+from pathlib import Path
 
+from tutorial_linter import Args, Rules, lint
+
+
+def write_project(directory: Path) -> Path:
+    """Creates a git project with a script and a lesson including its anchors,
+    and returns the lesson's path."""
+    (directory / ".git").mkdir()
+    (directory / "player.gd").write_text(
+        "extends Node\n# ANCHOR: ready\nfunc _ready():\n\tpass\n# END: ready\n"
+    )
+    lesson_path = directory / "lesson.md"
+    lesson_path.write_text(
+        "# Lesson\n\n```gdscript\n{% include player.gd ready %}\n```\n\n"
+        "```gdscript\n{% include player.gd missing %}\n```\n"
+    )
+    return lesson_path
+
+
+def test_lint_checks_include_anchors_without_an_index(tmp_path):
+    lesson_path = write_project(tmp_path)
+    issues = lint(lesson_path, Args(input_files=[lesson_path]))
+    anchor_issues = [i for i in issues if i.rule == Rules.include_anchor_not_found]
+    assert [issue.line for issue in anchor_issues] == [7]